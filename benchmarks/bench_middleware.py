@@ -0,0 +1,66 @@
+# Per-request overhead of the WSGI pipeline, run from the repository root:
+#   PYTHONPATH=. python benchmarks/bench_middleware.py
+
+import sys
+import time
+from io import BytesIO
+
+from kaychen.api import API
+from kaychen.middleware import Middleware
+
+
+class NoOpMiddleware(Middleware):
+    pass
+
+
+class RequestHookMiddleware(Middleware):
+    def process_request(self, req):
+        pass
+
+
+def build_app(middleware_count):
+    app = API(templates_dir="tests/templates")
+
+    @app.route("/hello/{name}")
+    def greeting(req, resp, name):
+        resp.text = f"Hello, {name}"
+
+    for i in range(middleware_count):
+        app.add_middleware(RequestHookMiddleware if i % 2 else NoOpMiddleware)
+    return app
+
+
+def environ():
+    return {
+        "REQUEST_METHOD": "GET",
+        "SCRIPT_NAME": "",
+        "PATH_INFO": "/hello/carla",
+        "QUERY_STRING": "",
+        "SERVER_NAME": "testserver",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "wsgi.url_scheme": "http",
+        "wsgi.input": BytesIO(),
+        "wsgi.errors": sys.stderr,
+    }
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def bench(middleware_count, requests=20000):
+    app = build_app(middleware_count)
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(requests):
+            b"".join(app(environ(), start_response))
+        best = min(best, time.perf_counter() - start)
+    return best / requests * 1e6
+
+
+if __name__ == "__main__":
+    for middleware_count in (0, 4, 16):
+        usec = bench(middleware_count)
+        print(f"{middleware_count:>3} middlewares: {usec:7.2f} us/request")
@@ -0,0 +1,61 @@
+# Memory and attribute access cost of ORM rows, run from the repository root:
+#   PYTHONPATH=. python benchmarks/bench_orm_rows.py
+
+import time
+import tracemalloc
+
+from kaychen.orm import Column, Database, Table
+
+ROWS = 100_000
+
+
+class Author(Table):
+    name = Column(str)
+    age = Column(int)
+
+
+def build_database():
+    db = Database(":memory:")
+    db.create(Author)
+    db.conn.executemany(
+        "INSERT INTO author (age, name) VALUES (?, ?);",
+        [(i % 90, f"Author {i}") for i in range(ROWS)],
+    )
+    db.conn.commit()
+    return db
+
+
+def measure(load):
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = load()
+    load_time = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for row in rows:
+        row.name
+        row.age
+    access_time = time.perf_counter() - start
+
+    return {
+        "bytes_per_row": memory / ROWS,
+        "load_us_per_row": load_time / ROWS * 1e6,
+        "attribute_ns": access_time / (2 * ROWS) * 1e9,
+    }
+
+
+if __name__ == "__main__":
+    db = build_database()
+    modes = {"all": lambda: db.all(Author)}
+    if hasattr(db, "rows"):
+        modes["rows"] = lambda: db.rows(Author)
+
+    for mode, load in modes.items():
+        result = measure(load)
+        print(
+            f"{mode:>5}: {result['bytes_per_row']:6.0f} bytes/row, "
+            f"{result['load_us_per_row']:5.2f} us/row to load, "
+            f"{result['attribute_ns']:5.1f} ns/attribute"
+        )
@@ -0,0 +1,268 @@
+# Benchmark suite for the request pipeline and the ORM, run from the
+# repository root:
+#   PYTHONPATH=. python benchmarks/run.py --output results.json
+#   PYTHONPATH=. python benchmarks/run.py --compare results.json
+# Each benchmark reports the best and median time per operation over a few
+# repeats. Results are written as JSON so two runs can be compared.
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+from kaychen.api import API
+from kaychen.middleware import Middleware
+from kaychen.orm import Column, Database, ForeignKey, Table
+
+REPEATS = 5
+
+
+def timed(operation, number, repeats=REPEATS, setup=None):
+    timings = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            operation()
+        timings.append((time.perf_counter() - start) / number)
+    return {
+        "best_us": min(timings) * 1e6,
+        "median_us": statistics.median(timings) * 1e6,
+        "number": number,
+    }
+
+
+def environ(path):
+    return {
+        "REQUEST_METHOD": "GET",
+        "SCRIPT_NAME": "",
+        "PATH_INFO": path,
+        "QUERY_STRING": "",
+        "SERVER_NAME": "testserver",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "wsgi.url_scheme": "http",
+        "wsgi.input": BytesIO(),
+        "wsgi.errors": sys.stderr,
+    }
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def build_app(route_count=1):
+    app = API(templates_dir="tests/templates")
+
+    for i in range(route_count):
+        app.add_route(f"/section{i}/items/{{id:d}}", lambda req, resp, id: None)
+        app.add_route(f"/section{i}/about", lambda req, resp: None)
+
+    @app.route("/json")
+    def json_handler(req, resp):
+        resp.json = {"items": [{"id": i, "name": f"item {i}"} for i in range(20)]}
+
+    @app.route("/html")
+    def html_handler(req, resp):
+        resp.html = "<html><body>" + "<p>hello</p>" * 20 + "</body></html>"
+
+    @app.route("/template")
+    def template_handler(req, resp):
+        resp.html = app.template("home.html", {"title": "Title", "name": "Name"})
+
+    @app.route("/hello/{name}")
+    def greeting(req, resp, name):
+        resp.text = f"Hello, {name}"
+
+    return app
+
+
+def bench_routing():
+    results = {}
+    for route_count in (10, 100, 1000):
+        app = build_app(route_count)
+        last = route_count - 1
+        # more distinct paths than the router's LRU holds, so the trie is walked
+        paths = [f"/section{last}/items/{i}" for i in range(4096)]
+        static_path = f"/section{last}/about"
+
+        def match_dynamic(paths=paths, find=app.find_handler):
+            for path in paths:
+                find(path)
+
+        results[f"{route_count}_routes_static"] = timed(
+            lambda: app.find_handler(static_path), 20000
+        )
+        result = timed(match_dynamic, 5)
+        for key in ("best_us", "median_us"):
+            result[key] /= len(paths)
+        results[f"{route_count}_routes_dynamic"] = result
+    return results
+
+
+class NoOpMiddleware(Middleware):
+    pass
+
+
+class RequestHookMiddleware(Middleware):
+    def process_request(self, req):
+        pass
+
+
+def bench_wsgi():
+    results = {}
+    for middleware_count in (0, 4, 16):
+        app = build_app()
+        for i in range(middleware_count):
+            app.add_middleware(RequestHookMiddleware if i % 2 else NoOpMiddleware)
+        results[f"{middleware_count}_middlewares"] = timed(
+            lambda: b"".join(app(environ("/hello/carla"), start_response)), 5000
+        )
+    return results
+
+
+def bench_responses():
+    app = build_app()
+    return {
+        kind: timed(lambda: b"".join(app(environ(f"/{kind}"), start_response)), 5000)
+        for kind in ("json", "html", "template")
+    }
+
+
+class Publisher(Table):
+    name = Column(str)
+
+
+class Author(Table):
+    name = Column(str)
+    age = Column(int)
+    publisher = ForeignKey(Publisher)
+
+
+class Book(Table):
+    title = Column(str)
+    published = Column(bool)
+    author = ForeignKey(Author)
+
+
+# FK depth 0, 1 and 2: each table references the one before it
+TABLES = {0: Publisher, 1: Author, 2: Book}
+
+
+def build_database(path, rows):
+    db = Database(path)
+    for table in TABLES.values():
+        db.create(table)
+
+    publishers = [Publisher(name=f"publisher {i}") for i in range(max(rows // 10, 1))]
+    db.save_many(publishers)
+    authors = [
+        Author(
+            name=f"author {i}", age=i % 90, publisher=publishers[i % len(publishers)]
+        )
+        for i in range(rows)
+    ]
+    db.save_many(authors)
+    db.save_many(
+        [
+            Book(title=f"book {i}", published=bool(i % 2), author=authors[i])
+            for i in range(rows)
+        ]
+    )
+    return db
+
+
+def row_factory(depth, db):
+    if depth == 0:
+        return lambda: Publisher(name="new")
+    if depth == 1:
+        publisher = db.get(Publisher, id=1)
+        return lambda: Author(name="new", age=1, publisher=publisher)
+    author = db.get(Author, id=1)
+    return lambda: Book(title="new", published=True, author=author)
+
+
+def bench_orm(directory):
+    results = {}
+    for rows in (100, 1000, 10000):
+        path = os.path.join(directory, f"bench_{rows}.db")
+        db = build_database(path, rows)
+        for depth, table in TABLES.items():
+            name = f"{table.__name__.lower()}_depth{depth}_{rows}_rows"
+            target = db.query(table).count() // 2 or 1
+            results[f"get_{name}"] = timed(lambda: db.get(table, id=target), 2000)
+            results[f"all_{name}"] = timed(
+                lambda: db.all(table), 3 if rows > 1000 else 20
+            )
+            new_row = row_factory(depth, db)
+            results[f"save_{name}"] = timed(lambda: db.save(new_row()), 200)
+        db.close()
+    return results
+
+
+SUITES = {
+    "routing": bench_routing,
+    "wsgi": bench_wsgi,
+    "responses": bench_responses,
+    "orm": bench_orm,
+}
+
+
+def run(selected):
+    results = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "benchmarks": {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        for name in selected:
+            print(f"running {name}...", file=sys.stderr)
+            suite = SUITES[name]
+            if name == "orm":
+                results["benchmarks"][name] = suite(directory)
+            else:
+                results["benchmarks"][name] = suite()
+    return results
+
+
+def report(results, baseline=None):
+    for suite, benchmarks in results["benchmarks"].items():
+        print(f"\n{suite}")
+        for name, result in benchmarks.items():
+            line = f"  {name:<40} {result['best_us']:12.2f} us"
+            if baseline is not None:
+                previous = baseline["benchmarks"].get(suite, {}).get(name)
+                if previous is not None:
+                    change = result["best_us"] / previous["best_us"] - 1
+                    line += f"  {change:+7.1%}"
+            print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("suites", nargs="*", help=f"any of {', '.join(SUITES)}")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    args = parser.parse_args()
+    for suite in args.suites:
+        if suite not in SUITES:
+            parser.error(f"unknown suite {suite!r}")
+
+    results = run(args.suites or list(SUITES))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
@@ -81,3 +81,12 @@ def json_handler(req, resp):
 @app.route("/text")
 def text_handler(req, resp):
     resp.text = "This is a simple text"
+
+
+# served by ASGI servers, e.g. `uvicorn app:asgi_app`
+asgi_app = app.asgi
+
+
+@app.route("/async")
+async def async_handler(req, resp):
+    resp.text = "This is an async handler"
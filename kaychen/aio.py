@@ -0,0 +1,301 @@
+import asyncio
+import contextvars
+import queue
+import threading
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from itertools import islice
+
+from .groupcommit import _STOP, commit_group
+from .orm import Database, Query, Table
+
+# the transaction a coroutine is in, jobs of other coroutines wait for it
+_transaction_owner = contextvars.ContextVar("kaychen_async_transaction", default=None)
+
+
+class _Job:
+    __slots__ = ("function", "args", "context", "owner", "write", "future")
+
+    def __init__(self, function, args, write):
+        self.function = function
+        self.args = args
+        self.context = contextvars.copy_context()
+        self.owner = _transaction_owner.get()
+        self.write = write
+        self.future = Future()
+
+    def call(self):
+        return self.context.run(self.function, *self.args)
+
+    def run(self):
+        if not self.future.set_running_or_notify_cancel():
+            return
+        try:
+            result = self.call()
+        except BaseException as e:
+            self.future.set_exception(e)
+        else:
+            self.future.set_result(result)
+
+
+# Runs a Database on a dedicated thread so async handlers never block the
+# event loop on sqlite. The models are the same Table classes. Small writes
+# that queue up while the thread is busy are committed together in one
+# transaction, each in its own savepoint so a failing write only fails its
+# caller.
+class AsyncDatabase:
+    def __init__(self, path: str, max_batch=64, **database_options):
+        self.max_batch = max_batch
+        self.batches = 0
+        self.batched_writes = 0
+
+        self._queue = queue.SimpleQueue()
+        self._deferred = []
+        self._transactions = []
+        self._owner = None
+
+        started = Future()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(path, database_options, started),
+            name="kaychen-db",
+            daemon=True,
+        )
+        self._thread.start()
+        self.database = started.result()
+
+    def _run(self, path, database_options, started):
+        # the connection is created on the thread that uses it
+        try:
+            database = Database(path, **database_options)
+        except BaseException as e:
+            started.set_exception(e)
+            return
+        started.set_result(database)
+
+        while True:
+            job = self._next_job()
+            if job is _STOP:
+                break
+            if job.write and self._owner is None:
+                self._run_writes(database, job)
+            else:
+                job.run()
+        database.close()
+
+    def _next_job(self):
+        while True:
+            if self._owner is None and self._deferred:
+                return self._deferred.pop(0)
+            job = self._queue.get()
+            if job is _STOP or self._owner is None or job.owner == self._owner:
+                return job
+            # another coroutine holds a transaction open
+            self._deferred.append(job)
+
+    def _run_writes(self, database, job):
+        jobs = [job]
+        while len(jobs) < self.max_batch:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not _STOP and job.write and job.owner is None:
+                jobs.append(job)
+                continue
+            # runs right after this batch
+            self._deferred.insert(0, job)
+            break
+
+        if len(jobs) == 1:
+            jobs[0].run()
+            return
+
+        self.batches += 1
+        self.batched_writes += len(jobs)
+        jobs = [job for job in jobs if job.future.set_running_or_notify_cancel()]
+        results = commit_group(database, [job.call for job in jobs])
+
+        # callers only hear back once their write is committed
+        for job, (result, error) in zip(jobs, results):
+            if error is None:
+                job.future.set_result(result)
+            else:
+                job.future.set_exception(error)
+
+    def _put(self, function, *args, write=False) -> _Job:
+        job = _Job(function, args, write)
+        self._queue.put(job)
+        return job
+
+    async def _submit(self, function, *args, write=False):
+        job = self._put(function, *args, write=write)
+        return await asyncio.wrap_future(job.future)
+
+    async def run(self, function, *args):
+        # runs function(database, *args) on the database thread
+        return await self._submit(function, self.database, *args)
+
+    async def create(self, table: type[Table]):
+        return await self._submit(self.database.create, table)
+
+    async def migrate(self, *tables: type[Table]):
+        return await self._submit(self.database.migrate, *tables)
+
+    async def save(self, instance: Table):
+        return await self._submit(self.database.save, instance, write=True)
+
+    async def save_many(self, instances):
+        return await self._submit(self.database.save_many, instances)
+
+    async def update(self, instance: Table):
+        return await self._submit(self.database.update, instance, write=True)
+
+    async def update_many(self, instances):
+        return await self._submit(self.database.update_many, instances)
+
+    async def delete(self, table: type[Table], id):
+        return await self._submit(self.database.delete, table, id, write=True)
+
+    async def delete_many(self, table: type[Table], ids):
+        return await self._submit(self.database.delete_many, table, ids)
+
+    async def get(self, table: type[Table], id=None, lazy=False):
+        _reject_lazy(lazy)
+        return await self._submit(lambda: self.database.get(table, id=id))
+
+    async def all(self, table: type[Table], lazy=False):
+        _reject_lazy(lazy)
+        return await self._submit(self.database.all, table)
+
+    async def page(self, table: type[Table], after_id=None, limit=100, lazy=False):
+        _reject_lazy(lazy)
+        return await self._submit(self.database.page, table, after_id, limit)
+
+    async def rows(self, table: type[Table]):
+        return await self._submit(self.database.rows, table)
+
+    def query(self, table: type[Table], lazy=False) -> "AsyncQuery":
+        _reject_lazy(lazy)
+        return AsyncQuery(self, Query(self.database, table))
+
+    def iter(self, table: type[Table], batch_size=100, after_id=None, lazy=False):
+        query = self.query(table, lazy)
+        if after_id is not None:
+            query = query.filter(id__gt=after_id).order_by("id")
+        return query.iter(batch_size)
+
+    def session(self):
+        # the session travels with the context of each submitted call
+        return self.database.session()
+
+    @asynccontextmanager
+    async def transaction(self):
+        # the database thread only runs this coroutine's calls until the
+        # block ends, other callers wait in line
+        owner = _transaction_owner.get() or object()
+        token = _transaction_owner.set(owner)
+        try:
+            begin = self._put(self._begin, owner)
+            try:
+                await asyncio.wrap_future(begin.future)
+            except asyncio.CancelledError as e:
+                # once _begin runs on the thread it cannot be taken back, the
+                # transaction has to be ended or every other caller waits
+                if not begin.future.cancel():
+                    await self._end_transaction(begin, e)
+                raise
+
+            error = None
+            try:
+                yield self
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                await self._end_transaction(begin, error)
+        finally:
+            _transaction_owner.reset(token)
+
+    async def _end_transaction(self, begin: _Job, error):
+        # a cancelled caller still waits for _end, it runs in any case
+        end = self._put(self._end, begin.future, error)
+        await asyncio.shield(asyncio.wrap_future(end.future))
+
+    def _begin(self, owner):
+        transaction = self.database.transaction()
+        transaction.__enter__()
+        self._transactions.append(transaction)
+        self._owner = owner
+
+    def _end(self, begun: Future, error):
+        if begun.exception() is not None:
+            return
+        transaction = self._transactions.pop()
+        if not self._transactions:
+            self._owner = None
+        if error is None:
+            transaction.__exit__(None, None, None)
+        else:
+            transaction.__exit__(type(error), error, error.__traceback__)
+
+    async def close(self):
+        self._queue.put(_STOP)
+        await asyncio.to_thread(self._thread.join)
+
+
+def _reject_lazy(lazy: bool):
+    # a lazy foreign key would query the database from the event loop
+    if lazy:
+        raise ValueError("AsyncDatabase loads foreign keys eagerly")
+
+
+class AsyncQuery:
+    def __init__(self, database: AsyncDatabase, query: Query):
+        self.database = database
+        self._query = query
+
+    def filter(self, **conditions) -> "AsyncQuery":
+        return AsyncQuery(self.database, self._query.filter(**conditions))
+
+    def order_by(self, *fields: str) -> "AsyncQuery":
+        return AsyncQuery(self.database, self._query.order_by(*fields))
+
+    def limit(self, limit: int) -> "AsyncQuery":
+        return AsyncQuery(self.database, self._query.limit(limit))
+
+    def offset(self, offset: int) -> "AsyncQuery":
+        return AsyncQuery(self.database, self._query.offset(offset))
+
+    def only(self, *fields: str) -> "AsyncQuery":
+        return AsyncQuery(self.database, self._query.only(*fields))
+
+    async def all(self) -> list[Table]:
+        return await self.database._submit(self._query.all)
+
+    async def first(self):
+        return await self.database._submit(self._query.first)
+
+    async def count(self) -> int:
+        return await self.database._submit(self._query.count)
+
+    async def exists(self) -> bool:
+        return await self.database._submit(self._query.exists)
+
+    async def iter(self, batch_size=100):
+        # the cursor stays on the database thread, rows come back a batch at
+        # a time
+        submit = self.database._submit
+        rows = await submit(self._query.iter, batch_size)
+        try:
+            while True:
+                batch = await submit(lambda: list(islice(rows, batch_size)))
+                if not batch:
+                    break
+                for row in batch:
+                    yield row
+        finally:
+            await submit(rows.close)
+
+    def __aiter__(self):
+        return self.iter()
@@ -1,27 +1,73 @@
+import asyncio
 import inspect
 import os
+import threading
+import time
+from collections import OrderedDict
 
-from jinja2 import Environment, FileSystemLoader
-from parse import parse
+from jinja2 import (
+    ChoiceLoader,
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    ModuleLoader,
+)
 from requests import Session as RequestsSession
-from webob import Request
 from whitenoise import WhiteNoise
 from wsgiadapter import WSGIAdapter as RequestsWSGIAdapter
 
+from .asgi import build_environ, lifespan, read_body, send_wsgi_response
+from .metrics import current_timer
 from .middleware import Middleware
+from .request import Request
 from .response import CustomResponse as Response
+from .response import get_json_dumps
+from .router import Router
 
 
 class API:
-    def __init__(self, templates_dir="templates", static_dir="static"):
+    def __init__(
+        self,
+        templates_dir="templates",
+        static_dir="static",
+        json_backend=None,
+        templates_cache_dir=None,
+        templates_auto_reload=True,
+        compiled_templates_dir=None,
+        cacheable_templates=(),
+        fragment_cache_size=256,
+    ):
         self.routes = {}
+        self.json_dumps = get_json_dumps(json_backend)
+        self.router = Router()
 
         self.exception_handler = None
+        # set by MetricsMiddleware, phases are only timed while it is installed
+        self.metrics = None
+
+        self.templates_loader = FileSystemLoader(os.path.abspath(templates_dir))
+        loader = self.templates_loader
+        if compiled_templates_dir is not None:
+            # modules written by precompile_templates(target) win over sources
+            loader = ChoiceLoader([ModuleLoader(compiled_templates_dir), loader])
+
+        bytecode_cache = None
+        if templates_cache_dir is not None:
+            os.makedirs(templates_cache_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(templates_cache_dir)
 
         self.templates_env = Environment(
-            loader=FileSystemLoader(os.path.abspath(templates_dir))
+            loader=loader,
+            bytecode_cache=bytecode_cache,
+            auto_reload=templates_auto_reload,
         )
 
+        # rendered output of cacheable templates, keyed by name and context
+        self.cacheable_templates = set(cacheable_templates)
+        self.fragment_cache_size = fragment_cache_size
+        self.fragments = OrderedDict()
+        self._fragments_lock = threading.Lock()
+
         self.whitenoise = WhiteNoise(self.wsgi_app, root=static_dir)
         self.middleware = Middleware(self)
 
@@ -38,58 +84,172 @@ class API:
         response = self.handle_request(request)
         return response(environ, start_response)
 
-    def template(self, template_name: str, context: dict):
-        return self.templates_env.get_template(template_name).render(context)
+    async def asgi(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await lifespan(receive, send)
+
+        environ = build_environ(scope, await read_body(receive))
+
+        path_info = environ["PATH_INFO"]
+        if path_info.startswith("/static"):
+            environ["PATH_INFO"] = path_info[len("/static") :]
+            return await send_wsgi_response(self.whitenoise, environ, send)
+
+        request = Request(environ)
+        response = await self.middleware.handle_request_async(request)
+        await send_wsgi_response(response, environ, send)
+
+    def template(self, template_name: str, context: dict, stream=False, cache=None):
+        timer = current_timer() if self.metrics is not None else None
+        if timer is None or stream:
+            return self._template(template_name, context, stream, cache)
+
+        start = time.perf_counter()
+        try:
+            return self._template(template_name, context, stream, cache)
+        finally:
+            timer.add("template", time.perf_counter() - start)
+
+    def _template(self, template_name: str, context: dict, stream, cache):
+        if cache is None:
+            cache = template_name in self.cacheable_templates
+        if not cache or stream:
+            template = self.templates_env.get_template(template_name)
+            if stream:
+                return template.generate(context)
+            return template.render(context)
+
+        try:
+            key = (template_name, frozenset(context.items()))
+            hash(key)
+        except TypeError:
+            # unhashable context values are rendered every time
+            return self.templates_env.get_template(template_name).render(context)
+
+        with self._fragments_lock:
+            body = self.fragments.get(key)
+            if body is not None:
+                self.fragments.move_to_end(key)
+                return body
+
+        body = self.templates_env.get_template(template_name).render(context)
+        with self._fragments_lock:
+            self.fragments[key] = body
+            while len(self.fragments) > self.fragment_cache_size:
+                self.fragments.popitem(last=False)
+        return body
+
+    def precompile_templates(self, target=None):
+        # compile from the sources even when compiled modules are configured
+        env = self.templates_env.overlay(loader=self.templates_loader)
+        if target is not None:
+            env.compile_templates(target, zip=None, ignore_errors=False)
+            return env.list_templates()
 
-    def route(self, path, allowed_methods=None):
+        names = env.list_templates()
+        for name in names:
+            self.templates_env.get_template(name)
+        return names
+
+    def clear_template_cache(self):
+        self.templates_env.cache.clear()
+        with self._fragments_lock:
+            self.fragments.clear()
+
+    def route(self, path, allowed_methods=None, cache=None):
         def wrapper(handler):
-            self.add_route(path, handler, allowed_methods)
+            self.add_route(path, handler, allowed_methods, cache)
 
         return wrapper
 
-    def add_route(self, path, handler, allowed_methods=None):
+    def add_route(self, path, handler, allowed_methods=None, cache=None):
         assert path not in self.routes, "Such route already exists"
 
         if allowed_methods is None:
             allowed_methods = ["get", "post", "put", "patch", "delete", "options"]
 
-        self.routes[path] = {"handler": handler, "allowed_methods": allowed_methods}
+        self.routes[path] = {
+            "handler": handler,
+            "allowed_methods": allowed_methods,
+            "cache": cache,
+            "path": path,
+        }
+        self.router.add(path, self.routes[path])
 
     def add_exception_handler(self, exception_handler):
         self.exception_handler = exception_handler
 
     def handle_request(self, request: Request) -> Response:
-        response = Response()
+        response = Response(self.json_dumps)
+        timer = current_timer() if self.metrics is not None else None
 
-        handler_data, kwargs = self.find_handler(request.path)
         try:
-            if handler_data is not None:
-                if request.method.lower() not in handler_data["allowed_methods"]:
-                    raise AttributeError("Method not allowed", request.method)
-
-                handler = handler_data["handler"]
-                if inspect.isclass(handler):
-                    handler = getattr(handler(), request.method.lower(), None)
-                    if handler is None:
-                        raise AttributeError("Method not allowed", request.method)
-                    handler(request, response, **kwargs)
+            handler, kwargs = self.get_handler(request)
+            if timer is not None:
+                timer.lap("route")
+            if handler is None:
+                self.default_response(response)
+            elif inspect.iscoroutinefunction(handler):
+                asyncio.run(handler(request, response, **kwargs))
+            else:
                 handler(request, response, **kwargs)
+            if timer is not None:
+                timer.lap("handler")
+
+        except Exception as e:
+            if self.exception_handler is None:
+                raise e
             else:
+                self.exception_handler(request, response, e)
+            if timer is not None:
+                timer.lap("exception")
+        return response
+
+    async def handle_request_async(self, request: Request) -> Response:
+        response = Response(self.json_dumps)
+        timer = current_timer() if self.metrics is not None else None
+
+        try:
+            handler, kwargs = self.get_handler(request)
+            if timer is not None:
+                timer.lap("route")
+            if handler is None:
                 self.default_response(response)
+            elif inspect.iscoroutinefunction(handler):
+                await handler(request, response, **kwargs)
+            else:
+                await asyncio.to_thread(handler, request, response, **kwargs)
+            if timer is not None:
+                timer.lap("handler")
 
         except Exception as e:
             if self.exception_handler is None:
                 raise e
+            elif inspect.iscoroutinefunction(self.exception_handler):
+                await self.exception_handler(request, response, e)
             else:
                 self.exception_handler(request, response, e)
+            if timer is not None:
+                timer.lap("exception")
         return response
 
+    def get_handler(self, request: Request):
+        handler_data, kwargs = self.find_handler(request.path)
+        if handler_data is None:
+            return None, None
+
+        if request.method.lower() not in handler_data["allowed_methods"]:
+            raise AttributeError("Method not allowed", request.method)
+
+        handler = handler_data["handler"]
+        if inspect.isclass(handler):
+            handler = getattr(handler(), request.method.lower(), None)
+            if handler is None:
+                raise AttributeError("Method not allowed", request.method)
+        return handler, kwargs
+
     def find_handler(self, request_path: str):
-        for path, handler_data in self.routes.items():
-            res = parse(path, request_path)
-            if res is not None:
-                return handler_data, res.named
-        return None, None
+        return self.router.match(request_path)
 
     def default_response(self, response: Response):
         response.status_code = 404
@@ -100,5 +260,5 @@ class API:
         session.mount(prefix=base_url, adapter=RequestsWSGIAdapter(self))
         return session
 
-    def add_middleware(self, mid: type[Middleware]):
-        self.middleware.add(mid)
+    def add_middleware(self, mid: type[Middleware], **options):
+        self.middleware.add(mid, **options)
@@ -0,0 +1,104 @@
+import asyncio
+import io
+import sys
+
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        more_body = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def build_environ(scope, body: bytes) -> dict:
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin1").upper().replace("-", "_")
+        value = value.decode("latin1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+            continue
+        if name == "CONTENT_LENGTH":
+            continue
+
+        key = f"HTTP_{name}"
+        if key in environ:
+            value = f"{environ[key]},{value}"
+        environ[key] = value
+
+    return environ
+
+
+async def send_wsgi_response(wsgi_app, environ, send):
+    response_start = {}
+
+    def start_response(status, headers, exc_info=None):
+        response_start["status"] = int(status.split(" ", 1)[0])
+        response_start["headers"] = [
+            (name.lower().encode("latin1"), value.encode("latin1"))
+            for name, value in headers
+        ]
+
+    app_iter = wsgi_app(environ, start_response)
+    try:
+        await send({"type": "http.response.start", **response_start})
+
+        # lists of chunks are already in memory, anything else may block
+        # on I/O while producing the next chunk
+        if isinstance(app_iter, (list, tuple)):
+            for chunk in app_iter:
+                if chunk:
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+        else:
+            iterator = iter(app_iter)
+            while True:
+                chunk = await asyncio.to_thread(next, iterator, None)
+                if chunk is None:
+                    break
+                if chunk:
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        if hasattr(app_iter, "close"):
+            app_iter.close()
@@ -0,0 +1,170 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+from .middleware import Middleware
+from .response import CustomResponse as Response
+
+
+class CacheEntry:
+    __slots__ = (
+        "body",
+        "content_type",
+        "headers",
+        "etag",
+        "modified",
+        "expires",
+        "variants",
+    )
+
+    def __init__(self, body: bytes, content_type: str, headers: dict, ttl: float):
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers
+        self.etag = '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+        self.modified = int(time.time())
+        self.expires = time.monotonic() + ttl
+        # encoded bodies derived from this entry, e.g. compressed ones
+        self.variants = {}
+
+
+# Caches successful GET/HEAD responses of routes registered with
+# `@app.route(..., cache=ttl)`, or of every route when a default `ttl` is
+# given. Entries are keyed by method, path, query string and the `vary`
+# request headers, evicted least recently used beyond `max_entries`, and
+# answer conditional requests with 304 before the handler runs. Responses
+# that set a cookie are never cached, and cached ones carry a `Vary` header
+# naming the `vary` request headers.
+class CacheMiddleware(Middleware):
+    def __init__(self, app, max_entries=1024, ttl=None, vary=("Accept",)):
+        super().__init__(app)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.vary = ["HTTP_" + header.upper().replace("-", "_") for header in vary]
+        self.vary_header = ", ".join(vary)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def handle_request(self, request):
+        key, ttl, entry = self.lookup(request)
+        if entry is not None:
+            return self.respond(request, entry)
+
+        response = super().handle_request(request)
+        if key is None:
+            return response
+        return self.store(request, key, ttl, response)
+
+    async def handle_request_async(self, request):
+        key, ttl, entry = self.lookup(request)
+        if entry is not None:
+            return self.respond(request, entry)
+
+        response = await super().handle_request_async(request)
+        if key is None:
+            return response
+        return self.store(request, key, ttl, response)
+
+    def lookup(self, request):
+        if request.method not in ("GET", "HEAD"):
+            return None, None, None
+
+        handler_data, _ = self.api.find_handler(request.path)
+        if handler_data is None:
+            return None, None, None
+
+        ttl = handler_data.get("cache")
+        if ttl is None:
+            ttl = self.ttl
+        if ttl is None:
+            return None, None, None
+
+        environ = request.environ
+        key = (
+            request.method,
+            request.path,
+            environ.get("QUERY_STRING", ""),
+            *[environ.get(header) for header in self.vary],
+        )
+
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires <= time.monotonic():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        return key, ttl, entry
+
+    def store(self, request, key, ttl, response: Response) -> Response:
+        if response.status_code not in (200, "200", "200 OK"):
+            return response
+        if "Content-Encoding" in response.headers:
+            # already encoded for this client's Accept-Encoding
+            return response
+        headers = dict(response.headers)
+        if any(name.lower() == "set-cookie" for name in headers):
+            # the cookie belongs to this client only
+            return response
+        if self.vary_header:
+            vary = headers.get("Vary")
+            headers["Vary"] = (
+                f"{vary}, {self.vary_header}" if vary else self.vary_header
+            )
+
+        response.prepare()
+        body = response.body
+        if isinstance(body, str):
+            body = body.encode("UTF-8")
+        if not isinstance(body, bytes):
+            # streamed bodies are never buffered for the cache
+            return response
+
+        entry = CacheEntry(body, response.get_content_type_header(), headers, ttl)
+        with self._lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return self.respond(request, entry)
+
+    def respond(self, request, entry: CacheEntry) -> Response:
+        response = Response()
+        response.headers.update(entry.headers)
+        response.headers["ETag"] = entry.etag
+        response.headers["Last-Modified"] = formatdate(entry.modified, usegmt=True)
+        response.cache_entry = entry
+
+        if self.not_modified(request.environ, entry):
+            response.status_code = 304
+            return response
+
+        response.body = entry.body
+        response.content_type = entry.content_type
+        return response
+
+    def not_modified(self, environ, entry: CacheEntry) -> bool:
+        if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or entry.etag in tags
+
+        if_modified_since = environ.get("HTTP_IF_MODIFIED_SINCE")
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return entry.modified <= since
+        return False
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
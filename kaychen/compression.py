@@ -0,0 +1,150 @@
+import gzip
+import zlib
+
+from .middleware import Middleware
+from .response import NO_BODY_STATUSES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+UNCOMPRESSIBLE_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "font/woff",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/octet-stream",
+)
+
+
+def parse_accept_encoding(header: str) -> dict[str, float]:
+    encodings = {}
+    for part in header.split(","):
+        encoding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if encoding:
+            encodings[encoding.lower()] = quality
+    return encodings
+
+
+def gzip_stream(chunks, level: int):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def brotli_stream(chunks, quality: int):
+    compressor = brotli.Compressor(quality=quality)
+    try:
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+# Compresses response bodies with brotli (when installed) or gzip, as
+# negotiated through Accept-Encoding. Bodies below `minimum_size` and
+# already compressed content types are sent as they are, streamed bodies
+# are compressed chunk by chunk. Add it after CacheMiddleware so cached
+# responses keep their compressed variants in the cache entry.
+class CompressionMiddleware(Middleware):
+    def __init__(self, app, minimum_size=500, level=6, brotli_quality=4):
+        super().__init__(app)
+        self.minimum_size = minimum_size
+        self.level = level
+        self.brotli_quality = brotli_quality
+
+        self.encodings = ["gzip"]
+        if brotli is not None:
+            self.encodings.insert(0, "br")
+
+    def choose_encoding(self, environ):
+        accepted = parse_accept_encoding(environ.get("HTTP_ACCEPT_ENCODING", ""))
+        wildcard = accepted.get("*", 0.0)
+        best, best_quality = None, 0.0
+        for encoding in self.encodings:
+            quality = accepted.get(encoding, wildcard)
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.level, mtime=0)
+
+    def compress_stream(self, chunks, encoding: str):
+        if encoding == "br":
+            return brotli_stream(chunks, self.brotli_quality)
+        return gzip_stream(chunks, self.level)
+
+    def process_response(self, req, res):
+        if "Content-Encoding" in res.headers:
+            return
+
+        res.prepare()
+        not_modified = res.status in NO_BODY_STATUSES
+        if not_modified:
+            # a 304 from the cache carries the Vary and ETag its full
+            # response would have been sent with
+            entry = res.cache_entry
+            if entry is None:
+                return
+            content_type, body = entry.content_type, entry.body
+        else:
+            content_type, body = res.get_content_type_header(), res.body
+        if content_type.startswith(UNCOMPRESSIBLE_TYPES):
+            return
+
+        if isinstance(body, str):
+            body = body.encode("UTF-8")
+        if isinstance(body, bytes) and len(body) < self.minimum_size:
+            return
+
+        vary = res.headers.get("Vary")
+        res.headers["Vary"] = f"{vary}, Accept-Encoding" if vary else "Accept-Encoding"
+
+        encoding = self.choose_encoding(req.environ)
+        if encoding is None:
+            return
+        self.weaken_etag(res)
+        if not_modified:
+            return
+
+        if not isinstance(body, bytes):
+            res.body = self.compress_stream(body, encoding)
+        elif res.cache_entry is not None:
+            variants = res.cache_entry.variants
+            if encoding not in variants:
+                variants[encoding] = self.compress(body, encoding)
+            res.body = variants[encoding]
+        else:
+            res.body = self.compress(body, encoding)
+        res.headers["Content-Encoding"] = encoding
+
+    def weaken_etag(self, res):
+        # the encoded body is not byte for byte the one the tag was made for
+        etag = res.headers.get("ETag")
+        if etag is not None and not etag.startswith("W/"):
+            res.headers["ETag"] = "W/" + etag
@@ -0,0 +1,152 @@
+import contextvars
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from functools import partial
+
+_STOP = object()
+
+
+class _Write:
+    __slots__ = ("sql", "params", "context", "future")
+
+    def __init__(self, sql: str, params):
+        self.sql = sql
+        self.params = params
+        self.context = contextvars.copy_context()
+        self.future = Future()
+
+    def execute(self, database) -> int:
+        cursor = self.context.run(
+            database._execute, database.pool.conn, self.sql, self.params
+        )
+        return cursor.lastrowid
+
+
+# Commits a group of writes in one transaction, each call in its own
+# savepoint so a failing one only rolls back itself. Returns a (result,
+# error) pair for every call, when the commit fails all of them get its
+# error.
+def commit_group(database, calls) -> list[tuple]:
+    results = []
+    try:
+        with database.transaction():
+            for call in calls:
+                try:
+                    with database.transaction():
+                        results.append((call(), None))
+                except Exception as e:
+                    results.append((None, e))
+    except BaseException as e:
+        # the commit failed, none of the writes happened
+        results = [(None, e)] * len(calls)
+    return results
+
+
+# Write-behind for Database: single statement writes from any thread are
+# queued to one writer thread, which runs them in groups of up to
+# `max_group`, waiting at most `max_delay` seconds for a group to fill, and
+# commits each group once. Every write runs in its own savepoint, callers get
+# their lastrowid or their own error back after the commit.
+class GroupCommitWriter:
+    def __init__(self, database, max_group=64, max_delay=0.002):
+        self.database = database
+        self.max_group = max_group
+        self.max_delay = max_delay
+
+        self.groups = 0
+        self.writes = 0
+        self.errors = 0
+        self.largest_group = 0
+        self.max_queue_depth = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="kaychen-group-commit", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, sql: str, params=()) -> int:
+        write = _Write(sql, params)
+        with self._lock:
+            # nothing drains the queue once the writer thread has stopped
+            if self._closed:
+                raise sqlite3.ProgrammingError("Database is closed")
+            self._queue.put(write)
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        return write.future.result()
+
+    def _run(self):
+        while True:
+            write = self._queue.get()
+            if write is _STOP:
+                return
+            group = self._collect(write)
+            self._commit(group)
+            if group[-1] is _STOP:
+                return
+
+    def _collect(self, write) -> list:
+        group = [write]
+        deadline = time.monotonic() + self.max_delay
+        while len(group) < self.max_group:
+            try:
+                # whatever queued up during the last commit joins right away
+                write = self._queue.get_nowait()
+            except queue.Empty:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    write = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+            group.append(write)
+            if write is _STOP:
+                break
+        return group
+
+    def _commit(self, group):
+        database = self.database
+        writes = [write for write in group if write is not _STOP]
+        results = commit_group(
+            database, [partial(write.execute, database) for write in writes]
+        )
+
+        with self._lock:
+            self.groups += 1
+            self.writes += len(writes)
+            self.largest_group = max(self.largest_group, len(writes))
+            self.errors += sum(error is not None for _, error in results)
+
+        for write, (lastrowid, error) in zip(writes, results):
+            if error is None:
+                write.future.set_result(lastrowid)
+            else:
+                write.future.set_exception(error)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "groups": self.groups,
+                "writes": self.writes,
+                "errors": self.errors,
+                "average_group": self.writes / self.groups if self.groups else 0.0,
+                "largest_group": self.largest_group,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
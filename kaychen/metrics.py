@@ -0,0 +1,221 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from .middleware import Middleware
+from .response import CustomResponse as Response
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_current_timer = ContextVar("kaychen_request_timer", default=None)
+
+
+def current_timer():
+    return _current_timer.get()
+
+
+# Accumulates the phases of one request. `lap` charges the time since the
+# previous mark to a phase, `add` records a duration measured elsewhere
+# (database and template time overlap the handler phase). The SQL text is
+# only kept when `statements` is a list, which the profiler sets.
+class RequestTimer:
+    __slots__ = ("start", "mark", "phases", "queries", "statements")
+
+    def __init__(self):
+        self.start = self.mark = time.perf_counter()
+        self.phases = {}
+        self.queries = 0
+        self.statements = None
+
+    def lap(self, phase: str):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self.mark
+        self.mark = now
+
+    def add(self, phase: str, duration: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration
+
+    def query(self, duration: float, sql=None):
+        self.queries += 1
+        self.add("db", duration)
+        if self.statements is not None:
+            self.statements.append((sql, duration))
+
+    def server_timing(self, total: float) -> str:
+        timings = [
+            f"{phase};dur={value * 1000:.3f}" for phase, value in self.phases.items()
+        ]
+        timings.append(f"total;dur={total * 1000:.3f}")
+        return ", ".join(timings)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            total += count
+            yield bound, total
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.latency = {}
+        self.requests = {}
+        self.queries = {}
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def observe(self, method: str, route: str, status: str, timer, duration: float):
+        with self._lock:
+            histogram = self.latency.get((method, route))
+            if histogram is None:
+                histogram = self.latency[(method, route)] = Histogram(self.buckets)
+            histogram.observe(duration)
+
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            key = (method, route)
+            self.queries[key] = self.queries.get(key, 0) + timer.queries
+            for phase, value in timer.phases.items():
+                self.phases[phase] = self.phases.get(phase, 0.0) + value
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            lines.append(
+                "# HELP kaychen_request_duration_seconds Request latency by route."
+            )
+            lines.append("# TYPE kaychen_request_duration_seconds histogram")
+            for (method, route), histogram in self.latency.items():
+                labels = f'method="{_escape(method)}",route="{_escape(route)}"'
+                for bound, count in histogram.cumulative():
+                    lines.append(
+                        "kaychen_request_duration_seconds_bucket"
+                        f'{{{labels},le="{bound}"}} {count}'
+                    )
+                lines.append(
+                    f"kaychen_request_duration_seconds_sum{{{labels}}} {histogram.sum}"
+                )
+                lines.append(
+                    f"kaychen_request_duration_seconds_count{{{labels}}} {histogram.count}"
+                )
+
+            lines.append("# HELP kaychen_requests_total Requests by route and status.")
+            lines.append("# TYPE kaychen_requests_total counter")
+            for (method, route, status), count in self.requests.items():
+                lines.append(
+                    f'kaychen_requests_total{{method="{_escape(method)}",'
+                    f'route="{_escape(route)}",status="{status}"}} {count}'
+                )
+
+            lines.append("# HELP kaychen_db_queries_total ORM queries by route.")
+            lines.append("# TYPE kaychen_db_queries_total counter")
+            for (method, route), count in self.queries.items():
+                lines.append(
+                    f'kaychen_db_queries_total{{method="{_escape(method)}",'
+                    f'route="{_escape(route)}"}} {count}'
+                )
+
+            lines.append("# HELP kaychen_phase_seconds_total Time spent per phase.")
+            lines.append("# TYPE kaychen_phase_seconds_total counter")
+            for phase, value in self.phases.items():
+                lines.append(f'kaychen_phase_seconds_total{{phase="{phase}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self.latency.clear()
+            self.requests.clear()
+            self.queries.clear()
+            self.phases.clear()
+
+
+# Times every request and serves the collected metrics in the Prometheus
+# text format at `path`. Add it last so it wraps the other middleware; the
+# API and Database only record phases while it is installed.
+class MetricsMiddleware(Middleware):
+    def __init__(self, app, metrics=None, path="/metrics", server_timing=True):
+        super().__init__(app)
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.path = path
+        self.server_timing = server_timing
+        self.api.metrics = self.metrics
+
+    def handle_request(self, request):
+        if request.path == self.path:
+            return self.metrics_response()
+
+        timer = RequestTimer()
+        token = _current_timer.set(timer)
+        try:
+            process_request_hooks, process_response_hooks, app = self.chain
+            for process_request in process_request_hooks:
+                process_request(request)
+            timer.lap("middleware")
+            response = app.handle_request(request)
+            timer.lap("app")
+            for process_response in process_response_hooks:
+                process_response(request, response)
+            timer.lap("middleware")
+            return self.finish(request, response, timer)
+        finally:
+            _current_timer.reset(token)
+
+    async def handle_request_async(self, request):
+        if request.path == self.path:
+            return self.metrics_response()
+
+        timer = RequestTimer()
+        token = _current_timer.set(timer)
+        try:
+            process_request_hooks, process_response_hooks, app = self.chain
+            for process_request in process_request_hooks:
+                process_request(request)
+            timer.lap("middleware")
+            response = await app.handle_request_async(request)
+            timer.lap("app")
+            for process_response in process_response_hooks:
+                process_response(request, response)
+            timer.lap("middleware")
+            return self.finish(request, response, timer)
+        finally:
+            _current_timer.reset(token)
+
+    def finish(self, request, response: Response, timer: RequestTimer) -> Response:
+        response.prepare()
+        timer.lap("serialize")
+        duration = timer.mark - timer.start
+
+        handler_data, _ = self.api.find_handler(request.path)
+        route = "<unmatched>" if handler_data is None else handler_data["path"]
+        status = response.status.partition(" ")[0]
+        self.metrics.observe(request.method, route, status, timer, duration)
+
+        if self.server_timing:
+            response.headers["Server-Timing"] = timer.server_timing(duration)
+        return response
+
+    def metrics_response(self) -> Response:
+        response = Response()
+        response.body = self.metrics.render().encode()
+        response.content_type = "text/plain; version=0.0.4"
+        return response
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
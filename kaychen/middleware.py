@@ -1,7 +1,9 @@
-from webob import Request
+from .request import Request
 
 
 class Middleware:
+    _chain = None
+
     def __init__(self, app):
         self.app = app
 
@@ -11,16 +13,90 @@ class Middleware:
         return response(environ, start_response)
 
     def handle_request(self, request):
-        self.process_request(request)
-        response = self.app.handle_request(request)
-        self.process_response(request, response)
+        process_request_hooks, process_response_hooks, app = self.chain
+        for process_request in process_request_hooks:
+            process_request(request)
+        response = app.handle_request(request)
+        for process_response in process_response_hooks:
+            process_response(request, response)
+        return response
+
+    async def handle_request_async(self, request):
+        process_request_hooks, process_response_hooks, app = self.chain
+        for process_request in process_request_hooks:
+            process_request(request)
+        response = await app.handle_request_async(request)
+        for process_response in process_response_hooks:
+            process_response(request, response)
         return response
 
-    def add(self, middleware_cls):
-        self.app = middleware_cls(self.app)
+    @property
+    def api(self):
+        app = self.app
+        while isinstance(app, Middleware):
+            app = app.app
+        return app
+
+    @property
+    def chain(self):
+        if self._chain is None:
+            self._chain = self.compile()
+        return self._chain
+
+    def compile(self):
+        # Flattens the nested layers into hook lists, leaving out the no-op
+        # base hooks. A layer overriding handle_request keeps its own frame
+        # and ends the flat part of the chain.
+        process_request_hooks = []
+        process_response_hooks = []
+
+        layer = self
+        while True:
+            cls = type(layer)
+            if cls.process_request is not Middleware.process_request:
+                process_request_hooks.append(layer.process_request)
+            if cls.process_response is not Middleware.process_response:
+                process_response_hooks.append(layer.process_response)
+
+            layer = layer.app
+            if not isinstance(layer, Middleware) or _overrides_handle_request(layer):
+                break
+
+        process_response_hooks.reverse()
+        return process_request_hooks, process_response_hooks, layer
+
+    def add(self, middleware_cls, **options):
+        self.app = middleware_cls(self.app, **options)
+        self._chain = None
 
     def process_request(self, req):
         pass
 
     def process_response(self, req, res):
         pass
+
+
+# Binds an ORM session to the lifetime of each request, handlers find it as
+# `req.db_session` and repeated reads of a row are served from its identity map.
+class SessionMiddleware(Middleware):
+    def __init__(self, app, database):
+        super().__init__(app)
+        self.database = database
+
+    def handle_request(self, request):
+        with self.database.session() as session:
+            request.db_session = session
+            return super().handle_request(request)
+
+    async def handle_request_async(self, request):
+        with self.database.session() as session:
+            request.db_session = session
+            return await super().handle_request_async(request)
+
+
+def _overrides_handle_request(middleware: Middleware) -> bool:
+    cls = type(middleware)
+    return (
+        cls.handle_request is not Middleware.handle_request
+        or cls.handle_request_async is not Middleware.handle_request_async
+    )
@@ -0,0 +1,102 @@
+import hashlib
+
+SCHEMA_TABLE = "kaychen_schema"
+
+
+def schema_version(table) -> str:
+    # changes whenever the declared columns or indexes change
+    schema = "\n".join([table._get_create_sql(), *table._get_index_sql()])
+    return hashlib.blake2b(schema.encode(), digest_size=16).hexdigest()
+
+
+# Brings tables in line with their declaration and records the version of
+# each one. Tables whose recorded version matches are skipped without
+# looking at their columns, so restarting a worker costs a single query.
+class Migrator:
+    def __init__(self, database):
+        self.database = database
+        self.statements = []
+
+    def migrate(self, tables) -> list[str]:
+        database = self.database
+        with database.pool.writer() as conn:
+            self.conn = conn
+            self.execute(
+                f"CREATE TABLE IF NOT EXISTS {SCHEMA_TABLE} "
+                "(name TEXT PRIMARY KEY, version TEXT);",
+                record=False,
+            )
+            applied = dict(
+                self.execute(f"SELECT name, version FROM {SCHEMA_TABLE};", record=False)
+            )
+            pending = []
+            for table in tables:
+                version = schema_version(table)
+                if applied.get(table._table_name) != version:
+                    pending.append((table, version))
+            if not pending:
+                return []
+
+            # DDL is transactional in SQLite, a failed migration leaves the
+            # schema as it was
+            if not conn.in_transaction:
+                self.execute("BEGIN;", record=False)
+            try:
+                for table, version in pending:
+                    self.migrate_table(table)
+                    self.execute(
+                        f"INSERT OR REPLACE INTO {SCHEMA_TABLE} (name, version) "
+                        "VALUES (?, ?);",
+                        (table._table_name, version),
+                        record=False,
+                    )
+            except BaseException:
+                if database._transaction_depth == 0:
+                    conn.rollback()
+                raise
+            database._commit(conn)
+        return self.statements
+
+    def execute(self, sql: str, params=(), record=True):
+        if record:
+            self.statements.append(sql)
+        return self.database._execute(self.conn, sql, params)
+
+    def migrate_table(self, table):
+        name = table._table_name
+        existing = {
+            row[1]: row[2].upper()
+            for row in self.execute(f"PRAGMA table_info({name});", record=False)
+        }
+        declared = {"id": "INTEGER"}
+        for column, field in table._get_var_list():
+            declared[column] = field.sql_type
+
+        if not existing:
+            self.execute(table._get_create_sql())
+        elif any(declared.get(column) != type_ for column, type_ in existing.items()):
+            self.rebuild(table, existing, declared)
+        else:
+            # new nullable columns only touch the schema, not the rows
+            for column, sql_type in declared.items():
+                if column not in existing:
+                    self.execute(f"ALTER TABLE {name} ADD COLUMN {column} {sql_type};")
+
+        for sql in table._get_index_sql():
+            self.execute(sql)
+
+    def rebuild(self, table, existing, declared):
+        # Columns were removed or changed their type, which ALTER TABLE
+        # cannot do: copy the rows into a new table, then swap the names.
+        # The indexes go with the old table and are recreated.
+        name = table._table_name
+        new_name = f"{name}__new"
+        columns = ", ".join(column for column in declared if column in existing)
+
+        self.execute(f"DROP TABLE IF EXISTS {new_name};", record=False)
+        self.execute(table._get_create_sql().replace(f" {name} (", f" {new_name} (", 1))
+        self.execute(
+            f"INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {name};"
+        )
+        self.execute(f"DROP TABLE {name};")
+        self.execute(f"ALTER TABLE {new_name} RENAME TO {name};")
@@ -1,76 +1,158 @@
 import sqlite3
-from typing import Any
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+from copy import copy
+from operator import itemgetter
 import inspect
 
+from .groupcommit import GroupCommitWriter
+from .metrics import current_timer
+from .migrations import Migrator
+from .pool import ConnectionPool, SingleConnection
 
-class Table:
-    def __init__(self, **kwargs):
-        self._data = {"id": None}
-        self._data.update(kwargs)
 
-    def __getattribute__(self, __name: str) -> Any:
-        _data: dict = super().__getattribute__("_data")
-        if __name in _data.keys():
-            return _data[__name]
-        return super().__getattribute__(__name)
+class TableMeta(type):
+    def __new__(mcs, name, bases, namespace, **kwargs):
+        # rows keep their values in the `_values` slot of Table, subclasses
+        # get no per-instance __dict__
+        namespace.setdefault("__slots__", ())
+        return super().__new__(mcs, name, bases, namespace, **kwargs)
 
-    def __setattr__(self, key, value):
-        super().__setattr__(key, value)
-        if key in self._data:
-            self._data[key] = value
 
-    def _get_update_sql(self):
-        cls = self.__class__
-        fields = []
-        values = []
+class Table(metaclass=TableMeta):
+    __slots__ = ("_values", "_database", "__weakref__")
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        # column metadata and SQL are computed once per class
+        fields = []
+        columns = []
+        foreign_keys = {}
         for name, field in inspect.getmembers(cls):
-            if isinstance(field, Column):
-                fields.append(name)
-                values.append(getattr(self, name))
-            elif isinstance(field, ForeignKey):
+            if isinstance(field, (Column, ForeignKey)):
+                # inherited fields get their own copy, the value layout of a
+                # subclass differs from its parent's
+                if field.owner is not cls:
+                    field = copy(field)
+                    field.owner = cls
+                    setattr(cls, name, field)
+                columns.append((name, field))
+
+        # values are laid out like the SELECT columns: id, then every column
+        # (foreign keys as their raw "<name>_id"), then one slot per foreign
+        # key for the related instance
+        for index, (name, field) in enumerate(columns, start=1):
+            field.index = index
+            if isinstance(field, ForeignKey):
                 fields.append(name + "_id")
-                values.append(getattr(self, name).id)
+                foreign_keys[name + "_id"] = (name, field)
+                setattr(cls, name + "_id", _ForeignKeyId(index))
+            else:
+                fields.append(name)
 
-        values.append(getattr(self, "id"))
+        for instance_index, (_, fk) in enumerate(foreign_keys.values()):
+            fk.instance_index = len(columns) + 1 + instance_index
+
+        cls._fields = fields
+        cls._foreign_keys = foreign_keys
+        cls._width = len(columns) + 1 + len(foreign_keys)
+        cls._unloaded = [_UNLOADED] * len(foreign_keys)
+        cls._values_getter = staticmethod(
+            _values_getter(len(columns), foreign_keys.values())
+        )
 
-        fields_string = ", ".join([f"{field} = ?" for field in fields])
         name = cls.__name__.lower()
-        sql = f"UPDATE {name} SET {fields_string} WHERE id = ?;"
+        cls._table_name = name
+        fields_string = ", ".join(fields)
+        select_fields = ["id"] + fields
+        select_fields_string = ", ".join(select_fields)
+        placeholders = ", ".join(["?"] * len(fields))
+        assignments = ", ".join([f"{field} = ?" for field in fields])
+
+        cls._select_fields = select_fields
+        cls._row_type = namedtuple(f"{cls.__name__}Row", select_fields)
+        cls._insert_sql = (
+            f"INSERT INTO {name} ({fields_string}) VALUES ({placeholders});"
+        )
+        cls._update_sql = f"UPDATE {name} SET {assignments} WHERE id = ?;"
+        cls._delete_sql = f"DELETE FROM {name} WHERE id = ?"
+        cls._select_all_sql = f"SELECT {select_fields_string} FROM {name};"
+        cls._select_where_sql = (
+            f"SELECT {select_fields_string} FROM {name} WHERE id = ?;"
+        )
+        cls._select_in_sql = (
+            f"SELECT {select_fields_string} FROM {name} WHERE id IN ({{}});"
+        )
 
-        return sql, values
+        indexes = []
+        for field_name, field in columns:
+            if isinstance(field, ForeignKey):
+                if field.indexed:
+                    indexes.append(Index(field_name))
+            elif field.unique:
+                indexes.append(Index(field_name, unique=True))
+            elif field.indexed:
+                indexes.append(Index(field_name))
+        indexes.extend(getattr(getattr(cls, "Meta", None), "indexes", ()))
+
+        cls._index_sql = []
+        for index in indexes:
+            if not isinstance(index, Index):
+                index = Index(*index)
+            index_columns = [cls._column_name(field) for field in index.fields]
+            index_name = index.name or "{}_{}_{}".format(
+                "ux" if index.unique else "ix", name, "_".join(index_columns)
+            )
+            cls._index_sql.append(
+                f"CREATE {'UNIQUE ' if index.unique else ''}INDEX IF NOT EXISTS "
+                f"{index_name} ON {name} ({', '.join(index_columns)});"
+            )
 
-    def _get_insert_sql(self):
-        cls = self.__class__
-        fields = []
-        placeholders = []
-        values = []
+    def __init__(self, **kwargs):
+        self._values = [None] * self._width
+        self._database = None
+        for key, value in kwargs.items():
+            setattr(self, key, value)
 
-        for name, field in inspect.getmembers(cls):
-            if isinstance(field, Column):
-                fields.append(name)
-                values.append(getattr(self, name))
-                placeholders.append("?")
-            elif isinstance(field, ForeignKey):
-                fields.append(name + "_id")
-                values.append(getattr(self, name).id)
-                placeholders.append("?")
+    @classmethod
+    def _from_row(cls, row, database=None):
+        instance = cls.__new__(cls)
+        instance._values = [*row, *cls._unloaded]
+        instance._database = database
+        return instance
 
-        fields = ", ".join(fields)
-        placeholders = ", ".join(placeholders)
+    def __json__(self) -> dict:
+        values = self._values
+        data = dict(zip(self._select_fields, values))
+        for name, fk in self._foreign_keys.values():
+            related = values[fk.instance_index]
+            if related is not _UNLOADED:
+                data[name] = related
+        return data
 
-        name = cls.__name__.lower()
-        sql = f"INSERT INTO {name} ({fields}) VALUES ({placeholders});"
+    @property
+    def id(self):
+        return self._values[0]
 
-        return sql, values
+    @id.setter
+    def id(self, value):
+        self._values[0] = value
 
-    @classmethod
-    def _get_delete_sql(cls, id):
-        DELETE_SQL = "DELETE FROM {name} WHERE id = ?"
+    def _get_update_sql(self):
+        values = list(self._values_getter(self))
+        values.append(self.id)
+        return self._update_sql, values
 
-        sql = DELETE_SQL.format(name=cls.__name__.lower())
+    def _get_insert_sql(self):
+        return self._insert_sql, list(self._values_getter(self))
 
-        return sql, [id]
+    @classmethod
+    def _get_delete_sql(cls, id):
+        return cls._delete_sql, [id]
 
     @classmethod
     def _get_var_list(cls):
@@ -79,8 +161,8 @@ class Table:
             if isinstance(var, Column):
                 var_list.append((name, var))
             if isinstance(var, ForeignKey):
-                name = var._table.__name__.lower() + "_id"
-                var_list.append((name, Column(int)))
+                # the same "<field>_id" column the insert and select use
+                var_list.append((name + "_id", Column(int)))
 
         var_list = sorted(var_list, key=lambda x: x[0])
         return var_list
@@ -97,33 +179,109 @@ class Table:
         return CREATE_TABLE_SQL.format(name=name, fields=fields)
 
     @classmethod
-    def _get_select_all_sql(cls):
-        fields = ["id"]
-        for name, field in inspect.getmembers(cls):
-            if isinstance(field, Column):
-                fields.append(name)
-            elif isinstance(field, ForeignKey):
-                fields.append(name + "_id")
+    def _get_index_sql(cls):
+        return list(cls._index_sql)
+
+    @classmethod
+    def _column_name(cls, field: str) -> str:
+        if field == "id" or field in cls._fields:
+            return field
+        if field + "_id" in cls._foreign_keys:
+            return field + "_id"
+        raise AttributeError(f"{cls.__name__} has no field {field}")
 
-        return f"SELECT {', '.join(fields)} FROM {cls.__name__.lower()};", fields
+    @classmethod
+    def _get_select_all_sql(cls):
+        return cls._select_all_sql, list(cls._select_fields)
 
     @classmethod
     def _get_select_where_sql(cls, id=None):
-        fields = ["id"]
+        return cls._select_where_sql, list(cls._select_fields), [id]
 
-        for name, field in inspect.getmembers(cls):
-            if isinstance(field, Column):
-                fields.append(name)
-            elif isinstance(field, ForeignKey):
-                fields.append(name + "_id")
+    @classmethod
+    def _get_select_in_sql(cls, ids):
+        sql = cls._select_in_sql.format(", ".join(["?"] * len(ids)))
+        return sql, list(cls._select_fields), list(ids)
+
+
+# marks a foreign key whose related row has not been fetched yet
+_UNLOADED = object()
+
+
+def _values_getter(column_count: int, foreign_keys):
+    if column_count == 0:
+        return lambda instance: ()
+
+    getter = itemgetter(*range(1, column_count + 1))
+    if column_count == 1:
+        plain_getter = lambda instance: (getter(instance._values),)
+    else:
+        plain_getter = lambda instance: getter(instance._values)
+
+    positions = [(fk.index - 1, fk.instance_index) for _, fk in foreign_keys]
+    if not positions:
+        return plain_getter
+
+    # a foreign key is written as the id of the related instance when one is
+    # set, so instances saved after being assigned get their current id
+    def values_getter(instance):
+        values = list(plain_getter(instance))
+        instances = instance._values
+        for position, instance_index in positions:
+            related = instances[instance_index]
+            if related is not None and related is not _UNLOADED:
+                values[position] = related.id
+        return values
+
+    return values_getter
+
+
+class _ForeignKeyId:
+    __slots__ = ("index",)
+
+    def __init__(self, index: int):
+        self.index = index
 
-        sql = f"SELECT {', '.join(fields)} FROM {cls.__name__.lower()} WHERE id = ?;"
-        return sql, fields, [id]
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return instance._values[self.index]
 
 
 class ForeignKey:
-    def __init__(self, table: type[Table]):
+    def __init__(self, table: type[Table], index=True):
         self._table = table
+        self.indexed = index
+        self.name = None
+        self.owner = None
+        self.index = None
+        self.instance_index = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.owner = owner
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+
+        values = instance._values
+        value = values[self.instance_index]
+        if value is _UNLOADED:
+            # fetched with lazy=True, the related row is loaded on first access
+            value = values[self.index]
+            database = instance._database
+            if value is not None and database is not None:
+                value = database.get(self._table, id=value)
+            else:
+                value = None
+            values[self.instance_index] = value
+        return value
+
+    def __set__(self, instance, value):
+        values = instance._values
+        values[self.instance_index] = value
+        values[self.index] = None if value is None else value.id
 
     @property
     def table(self):
@@ -131,8 +289,23 @@ class ForeignKey:
 
 
 class Column:
-    def __init__(self, column_type: type):
+    def __init__(self, column_type: type, index=False, unique=False):
         self.type = column_type
+        self.indexed = index
+        self.unique = unique
+        self.owner = None
+        self.index = None
+
+    def __set_name__(self, owner, name):
+        self.owner = owner
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        return instance._values[self.index]
+
+    def __set__(self, instance, value):
+        instance._values[self.index] = value
 
     @property
     def sql_type(self):
@@ -146,58 +319,609 @@ class Column:
         return SQLITE_TYPE_MAP[self.type]
 
 
+# A composite index, declared in a table's Meta:
+#   class Meta:
+#       indexes = [("author", "published"), Index("title", unique=True)]
+class Index:
+    def __init__(self, *fields: str, unique=False, name=None):
+        self.fields = fields
+        self.unique = unique
+        self.name = name
+
+
+IN_BATCH_SIZE = 500
+
+
+# SQL text of statements that are built per call (queries, IN lists), keyed
+# by (table, operation, column set), so repeated calls skip building the
+# string. The hits and misses count string building only. Reusing prepared
+# statements is up to sqlite's per-connection cache (`cached_statements`),
+# which matches on equal SQL text.
+class StatementCache:
+    def __init__(self, size=256):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build) -> str:
+        with self._lock:
+            sql = self._entries.get(key)
+            if sql is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return sql
+            self.misses += 1
+
+        sql = build()
+        with self._lock:
+            self._entries[key] = sql
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return sql
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
 class Database:
-    def __init__(self, path: str):
-        self.conn = sqlite3.Connection(path)
+    def __init__(
+        self,
+        path: str,
+        pool_size=None,
+        statement_cache_size=256,
+        cached_statements=256,
+        group_commit=False,
+        max_group=64,
+        max_delay=0.002,
+        read_only=False,
+        **pool_options,
+    ):
+        if pool_size is None:
+            self.pool = SingleConnection(path, cached_statements, read_only)
+        else:
+            self.pool = ConnectionPool(
+                path,
+                readers=pool_size,
+                cached_statements=cached_statements,
+                read_only=read_only,
+                **pool_options,
+            )
+        self.conn = self.pool.conn
+        self.cached_statements = cached_statements
+        self.statements = StatementCache(statement_cache_size)
+        # every distinct SQL text executed; while there are no more than
+        # `cached_statements` of them no connection prepares one twice
+        self.executed_sql = set()
+        self._transaction_depth = 0
+        self._session = ContextVar(f"kaychen_session_{id(self)}", default=None)
+
+        self.group_writer = None
+        if group_commit:
+            if pool_size is None:
+                raise ValueError("Group commit needs a connection pool (pool_size)")
+            self.group_writer = GroupCommitWriter(self, max_group, max_delay)
+
+    @contextmanager
+    def session(self):
+        # reads inside the block share one identity map, so repeated lookups
+        # of a row return the same instance without another query
+        session = Session(self)
+        token = self._session.set(session)
+        try:
+            yield session
+        finally:
+            self._session.reset(token)
+
+    def _identity_map(self) -> dict:
+        session = self._session.get()
+        if session is None:
+            return {}
+        return session.identity_map
+
+    def _invalidate(self, table: type[Table], ids):
+        session = self._session.get()
+        if session is not None:
+            for id in ids:
+                session.identity_map.pop((table, id), None)
+
+    @contextmanager
+    def transaction(self):
+        # the outermost block commits or rolls back, nested blocks use
+        # savepoints so they can fail without discarding the outer work
+        with self.pool.writer() as conn:
+            depth = self._transaction_depth
+            savepoint = f"kaychen_{depth}"
+            if depth > 0:
+                self._execute(conn, f"SAVEPOINT {savepoint};")
+            elif not conn.in_transaction:
+                # begin explicitly, otherwise a savepoint opened before the
+                # first write would start its own transaction and its
+                # RELEASE would commit
+                self._execute(conn, "BEGIN;")
+
+            self._transaction_depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._transaction_depth -= 1
+                if depth > 0:
+                    self._execute(conn, f"ROLLBACK TO {savepoint};")
+                    self._execute(conn, f"RELEASE {savepoint};")
+                else:
+                    conn.rollback()
+                raise
+            else:
+                self._transaction_depth -= 1
+                if depth > 0:
+                    self._execute(conn, f"RELEASE {savepoint};")
+                else:
+                    conn.commit()
+
+    def _commit(self, conn: sqlite3.Connection):
+        # only called while holding the writer, which also guards the depth
+        if self._transaction_depth == 0:
+            conn.commit()
+
+    def _execute(self, conn: sqlite3.Connection, sql: str, params=()):
+        self.executed_sql.add(sql)
+        timer = current_timer()
+        if timer is None:
+            return conn.execute(sql, params)
+        start = time.perf_counter()
+        try:
+            return conn.execute(sql, params)
+        finally:
+            timer.query(time.perf_counter() - start, sql)
+
+    def _executemany(self, conn: sqlite3.Connection, sql: str, seq_of_params):
+        self.executed_sql.add(sql)
+        timer = current_timer()
+        if timer is None:
+            return conn.executemany(sql, seq_of_params)
+        start = time.perf_counter()
+        try:
+            return conn.executemany(sql, seq_of_params)
+        finally:
+            timer.query(time.perf_counter() - start, sql)
+
+    def _fetchall(self, sql: str, params=()) -> list:
+        with self.pool.reader() as conn:
+            return self._execute(conn, sql, params).fetchall()
+
+    def _fetchone(self, sql: str, params=()):
+        with self.pool.reader() as conn:
+            return self._execute(conn, sql, params).fetchone()
+
+    def _write(self, sql: str, params=()) -> int:
+        # writes inside a transaction of this thread cannot wait for the
+        # group writer, it would need the writer they hold
+        if self.group_writer is not None and not self.pool.holds_writer():
+            return self.group_writer.submit(sql, params)
+        with self.pool.writer() as conn:
+            cursor = self._execute(conn, sql, params)
+            self._commit(conn)
+            return cursor.lastrowid
+
+    def close(self):
+        if self.group_writer is not None:
+            self.group_writer.close()
+        self.pool.close()
+
+    def statement_metrics(self) -> dict:
+        return {
+            "size": self.statements.size,
+            "entries": len(self.statements),
+            "hits": self.statements.hits,
+            "misses": self.statements.misses,
+            "distinct_sql": len(self.executed_sql),
+            "cached_statements": self.cached_statements,
+        }
 
     @property
     def tables(self) -> list[type[Table]]:
         SELECT_TABLES_SQL = "SELECT name FROM sqlite_master WHERE type = 'table';"
-        return [x[0] for x in self.conn.execute(SELECT_TABLES_SQL).fetchall()]
+        return [x[0] for x in self._fetchall(SELECT_TABLES_SQL)]
 
     def create(self, table: type[Table]):
-        self.conn.execute(table._get_create_sql())
+        with self.pool.writer() as conn:
+            self._execute(conn, table._get_create_sql())
+            for sql in table._get_index_sql():
+                self._execute(conn, sql)
+            self._commit(conn)
+
+    def migrate(self, *tables: type[Table]) -> list[str]:
+        # creates or alters the tables to match their declaration, returns
+        # the statements that were applied
+        return Migrator(self).migrate(tables)
+
+    def explain(self, query, params=()) -> list[str]:
+        # the steps of SQLite's plan for a Query or an SQL string, e.g.
+        # "SEARCH book USING INDEX ix_book_author_id (author_id=?)"
+        if isinstance(query, Query):
+            query, _, params = query._get_sql()
+        rows = self._fetchall("EXPLAIN QUERY PLAN " + query, params)
+        return [row[3] for row in rows]
 
     def save(self, table: Table):
         sql, values = table._get_insert_sql()
-        cursor = self.conn.execute(sql, values)
-        table._data["id"] = cursor.lastrowid
-        self.conn.commit()
-
-    def all(self, table: type[Table]):
+        table.id = self._write(sql, values)
+        session = self._session.get()
+        if session is not None:
+            session.identity_map[(type(table), table.id)] = table
+
+    def save_many(self, instances):
+        with self.transaction():
+            conn = self.pool.conn
+            for table, group in _group_by_table(instances).items():
+                self._executemany(
+                    conn, table._insert_sql, [table._values_getter(i) for i in group]
+                )
+                # AUTOINCREMENT ids of one multi-row insert are consecutive
+                cursor = self._execute(conn, "SELECT last_insert_rowid();")
+                first_id = cursor.fetchone()[0] - len(group) + 1
+                for offset, instance in enumerate(group):
+                    instance.id = first_id + offset
+
+    def all(self, table: type[Table], lazy=False):
         sql, fields = table._get_select_all_sql()
+        rows = self._fetchall(sql)
+        return self._build(table, rows, self._identity_map(), lazy)
+
+    def iter(self, table: type[Table], batch_size=100, after_id=None, lazy=False):
+        query = self.query(table, lazy)
+        if after_id is not None:
+            query = query.filter(id__gt=after_id).order_by("id")
+        return query.iter(batch_size)
+
+    def page(self, table: type[Table], after_id=None, limit=100, lazy=False):
+        # keyset pagination, pass the id of the last row to get the next page
+        query = self.query(table, lazy).order_by("id").limit(limit)
+        if after_id is not None:
+            query = query.filter(id__gt=after_id)
+        return query.all()
+
+    def get(self, table: type[Table], id=None, lazy=False):
+        identity_map = self._identity_map()
+        instance = identity_map.get((table, id))
+        if instance is not None:
+            return instance
 
-        result = []
-        for row in self.conn.execute(sql).fetchall():
-            instance = table()
-            for field, value in zip(fields, row):
-                if field.endswith("_id"):
-                    field = field[:-3]
-                    fk = getattr(table, field)
-                    value = self.get(fk.table, id=value)
-                setattr(instance, field, value)
-            result.append(instance)
-
-        return result
-
-    def get(self, table: type[Table], id=None):
         sql, fields, vals = table._get_select_where_sql(id=id)
-        row = self.conn.execute(sql, vals).fetchone()
-        instance = table()
-        for field, value in zip(fields, row):
-            if field.endswith("_id"):
-                field = field[:-3]
-                fk = getattr(table, field)
-                value = self.get(fk.table, id=value)
-            setattr(instance, field, value)
-        return instance
+        row = self._fetchone(sql, vals)
+        if row is None:
+            raise LookupError(f"{table.__name__} with id {id} does not exist")
+        return self._build(table, [row], identity_map, lazy)[0]
+
+    def _build(
+        self, table: type[Table], rows, identity_map: dict, lazy: bool, fields=None
+    ):
+        database = self if lazy else None
+        select_fields = table._select_fields
+        if fields is None or fields == select_fields:
+            fields = select_fields
+            from_row = table._from_row
+            instances = []
+            for row in rows:
+                # rows already in the identity map keep their instance
+                key = (table, row[0])
+                instance = identity_map.get(key)
+                if instance is None:
+                    instance = identity_map[key] = from_row(row, database)
+                instances.append(instance)
+        else:
+            # a projection, columns that were not selected stay None
+            indices = [select_fields.index(field) for field in fields]
+            empty = [None] * len(select_fields) + table._unloaded
+            instances = []
+            for row in rows:
+                values = list(empty)
+                for index, value in zip(indices, row):
+                    values[index] = value
+                instance = table.__new__(table)
+                instance._values = values
+                instance._database = database
+                instances.append(instance)
+
+        if lazy:
+            return instances
+
+        for column, (name, fk) in table._foreign_keys.items():
+            if column not in fields:
+                continue
+
+            index = fk.index
+            instance_index = fk.instance_index
+            related_table = fk.table
+            self._load_related(related_table, instances, index, identity_map)
+            for instance in instances:
+                values = instance._values
+                value = values[index]
+                if value is not None:
+                    value = identity_map.get((related_table, value))
+                values[instance_index] = value
+
+        return instances
+
+    def rows(self, table: type[Table]) -> list[tuple]:
+        # read-only named tuples of the raw columns, foreign keys stay ids
+        sql, fields = table._get_select_all_sql()
+        return list(map(table._row_type._make, self._fetchall(sql)))
+
+    def _load_related(self, table: type[Table], instances, index, identity_map):
+        # one "WHERE id IN (...)" query per batch of missing ids, rows that
+        # are already in the identity map are not fetched again
+        ids = {instance._values[index] for instance in instances}
+        ids = [id for id in ids if id is not None and (table, id) not in identity_map]
+
+        rows = []
+        for start in range(0, len(ids), IN_BATCH_SIZE):
+            batch = ids[start : start + IN_BATCH_SIZE]
+            # pad the list to a power of two so only a handful of distinct
+            # IN statements are ever prepared
+            size = min(1 << (len(batch) - 1).bit_length(), IN_BATCH_SIZE)
+            batch += batch[-1:] * (size - len(batch))
+            sql = self.statements.get(
+                (table, "select_in", size),
+                lambda: table._get_select_in_sql(batch)[0],
+            )
+            rows.extend(self._fetchall(sql, batch))
+
+        if rows:
+            self._build(table, rows, identity_map, lazy=False)
+
+    def query(self, table: type[Table], lazy=False) -> "Query":
+        return Query(self, table, lazy)
 
     def update(self, instance):
         sql, values = instance._get_update_sql()
-        self.conn.execute(sql, values)
-        self.conn.commit()
+        self._write(sql, values)
+        self._invalidate(type(instance), [instance.id])
+
+    def update_many(self, instances):
+        with self.transaction():
+            for table, group in _group_by_table(instances).items():
+                self._invalidate(table, [i.id for i in group])
+                self._executemany(
+                    self.pool.conn,
+                    table._update_sql,
+                    [(*table._values_getter(i), i.id) for i in group],
+                )
 
     def delete(self, table, id):
         sql, params = table._get_delete_sql(id)
-        self.conn.execute(sql, params)
-        self.conn.commit()
+        self._write(sql, params)
+        self._invalidate(table, [id])
+
+    def delete_many(self, table: type[Table], ids):
+        ids = list(ids)
+        self._invalidate(table, ids)
+        with self.transaction():
+            self._executemany(self.pool.conn, table._delete_sql, [(id,) for id in ids])
+
+
+class Session:
+    def __init__(self, database: Database):
+        self.database = database
+        self.identity_map = {}
+
+    def get(self, table: type[Table], id=None, lazy=False):
+        return self.database.get(table, id=id, lazy=lazy)
+
+    def all(self, table: type[Table], lazy=False):
+        return self.database.all(table, lazy=lazy)
+
+    def query(self, table: type[Table], lazy=False) -> "Query":
+        return self.database.query(table, lazy=lazy)
+
+    def clear(self):
+        self.identity_map.clear()
+
+
+LOOKUPS = {
+    "exact": "{} = ?",
+    "ne": "{} != ?",
+    "gt": "{} > ?",
+    "gte": "{} >= ?",
+    "lt": "{} < ?",
+    "lte": "{} <= ?",
+}
+
+
+class Query:
+    def __init__(self, database: Database, table: type[Table], lazy=False):
+        self.database = database
+        self.table = table
+        self.lazy = lazy
+        self._where = []
+        self._params = []
+        self._order_by = []
+        self._limit = None
+        self._offset = None
+        self._fields = None
+
+    def _clone(self) -> "Query":
+        query = Query(self.database, self.table, self.lazy)
+        query._where = list(self._where)
+        query._params = list(self._params)
+        query._order_by = list(self._order_by)
+        query._limit = self._limit
+        query._offset = self._offset
+        query._fields = self._fields
+        return query
+
+    def _column(self, field: str) -> str:
+        return self.table._column_name(field)
+
+    def filter(self, **conditions) -> "Query":
+        query = self._clone()
+        for key, value in conditions.items():
+            field, _, lookup = key.partition("__")
+            column = self._column(field)
+            if isinstance(value, Table):
+                value = value.id
+
+            if lookup == "in":
+                values = [v.id if isinstance(v, Table) else v for v in value]
+                placeholders = ", ".join(["?"] * len(values))
+                query._where.append(f"{column} IN ({placeholders})")
+                query._params.extend(values)
+            elif lookup == "isnull":
+                query._where.append(f"{column} IS {'' if value else 'NOT '}NULL")
+            elif lookup in ("", "exact") and value is None:
+                query._where.append(f"{column} IS NULL")
+            elif lookup in LOOKUPS or lookup == "":
+                query._where.append(LOOKUPS[lookup or "exact"].format(column))
+                query._params.append(value)
+            else:
+                raise AttributeError(f"Unknown lookup {lookup}")
+        return query
+
+    def order_by(self, *fields: str) -> "Query":
+        query = self._clone()
+        for field in fields:
+            if field.startswith("-"):
+                query._order_by.append(f"{self._column(field[1:])} DESC")
+            else:
+                query._order_by.append(f"{self._column(field)} ASC")
+        return query
+
+    def limit(self, limit: int) -> "Query":
+        query = self._clone()
+        query._limit = limit
+        return query
+
+    def offset(self, offset: int) -> "Query":
+        query = self._clone()
+        query._offset = offset
+        return query
+
+    def only(self, *fields: str) -> "Query":
+        query = self._clone()
+        query._fields = ["id"] + [self._column(f) for f in fields if f != "id"]
+        return query
+
+    def _get_select_sql(self, columns: str):
+        sql = f"SELECT {columns} FROM {self.table._table_name}"
+        if self._where:
+            sql += " WHERE " + " AND ".join(self._where)
+        if self._order_by:
+            sql += " ORDER BY " + ", ".join(self._order_by)
+        if self._limit is not None or self._offset is not None:
+            sql += " LIMIT ?"
+            if self._offset is not None:
+                sql += " OFFSET ?"
+        return sql
+
+    def _get_limit_params(self):
+        if self._limit is None and self._offset is None:
+            return []
+        limit = -1 if self._limit is None else self._limit
+        if self._offset is None:
+            return [limit]
+        return [limit, self._offset]
+
+    def _statement(self, operation: str, build) -> str:
+        key = (
+            self.table,
+            operation,
+            self._fields and tuple(self._fields),
+            tuple(self._where),
+            tuple(self._order_by),
+            self._limit is None,
+            self._offset is None,
+        )
+        return self.database.statements.get(key, build)
+
+    def _get_sql(self):
+        fields = self._fields or self.table._select_fields
+        sql = self._statement(
+            "select", lambda: self._get_select_sql(", ".join(fields)) + ";"
+        )
+        return sql, fields, self._params + self._get_limit_params()
+
+    def all(self) -> list[Table]:
+        sql, fields, params = self._get_sql()
+        rows = self.database._fetchall(sql, params)
+        return self.database._build(
+            self.table, rows, self._identity_map(), self.lazy, fields
+        )
+
+    def _identity_map(self) -> dict:
+        # instances of a projection are incomplete and never shared
+        if self._fields is not None:
+            return {}
+        return self.database._identity_map()
+
+    def iter(self, batch_size=100):
+        # rows are fetched and built batch by batch, memory stays constant
+        # no matter how many rows the query returns
+        sql, fields, params = self._get_sql()
+        database = self.database
+        pool = database.pool
+        # the generator may be resumed on another thread (e.g. a streamed
+        # response read through asyncio.to_thread), so its connection is
+        # private and lent to whichever thread resumed it last, whose reads
+        # (foreign keys, the loop body's own queries) share it
+        with pool.reader(private=True) as conn:
+            binding = pool.binding(conn)
+            cursor = database._execute(conn, sql, params)
+            try:
+                while True:
+                    binding.bind()
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    # a fresh identity map per batch, a session map would grow
+                    # with every row of the iteration
+                    for instance in database._build(
+                        self.table, rows, {}, self.lazy, fields
+                    ):
+                        yield instance
+                        binding.bind()
+            finally:
+                binding.unbind()
+                cursor.close()
+
+    def __iter__(self):
+        return self.iter()
+
+    def __json__(self) -> list[Table]:
+        return self.all()
+
+    def first(self):
+        results = self.limit(1).all()
+        return results[0] if results else None
+
+    def count(self) -> int:
+        if self._limit is None and self._offset is None:
+            sql = self._statement(
+                "count", lambda: self._get_select_sql("COUNT(*)") + ";"
+            )
+        else:
+            sql = self._statement(
+                "count", lambda: f"SELECT COUNT(*) FROM ({self._get_select_sql('1')});"
+            )
+        params = self._params + self._get_limit_params()
+        return self.database._fetchone(sql, params)[0]
+
+    def explain(self) -> list[str]:
+        return self.database.explain(self)
+
+    def exists(self) -> bool:
+        query = self.limit(1)
+        sql = query._statement("exists", lambda: query._get_select_sql("1") + ";")
+        params = query._params + query._get_limit_params()
+        return self.database._fetchone(sql, params) is not None
+
+
+def _group_by_table(instances) -> dict[type[Table], list[Table]]:
+    groups = {}
+    for instance in instances:
+        groups.setdefault(type(instance), []).append(instance)
+    return groups
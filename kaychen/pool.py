@@ -0,0 +1,238 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+# Default for Database: one connection used for reads and writes, exactly
+# like a bare sqlite3.Connection. A read-only connection (e.g. a replica)
+# can be shared between threads.
+class SingleConnection:
+    def __init__(self, path: str, cached_statements=128, read_only=False):
+        if read_only:
+            self.conn = sqlite3.Connection(
+                f"file:{path}?mode=ro",
+                uri=True,
+                check_same_thread=False,
+                cached_statements=cached_statements,
+            )
+        else:
+            self.conn = sqlite3.Connection(path, cached_statements=cached_statements)
+        self._context = nullcontext(self.conn)
+
+    def reader(self, private=False):
+        return self._context
+
+    def binding(self, conn) -> "ReaderBinding":
+        return ReaderBinding({}, conn)
+
+    def writer(self):
+        return self._context
+
+    def metrics(self) -> dict:
+        return {}
+
+    def close(self):
+        self.conn.close()
+
+
+# Lends a privately checked out reader to the nested reads of the thread
+# that currently runs its holder, e.g. a generator resumed on different
+# threads calls bind() after every resume. Moving to another thread takes
+# the reader back from the previous one. A thread that already has a reader
+# of its own keeps it.
+class ReaderBinding:
+    def __init__(self, readers: dict, conn: sqlite3.Connection):
+        self._readers = readers
+        self.conn = conn
+        self.thread = None
+
+    def bind(self):
+        thread = threading.get_ident()
+        if thread == self.thread:
+            return
+        self.unbind()
+        if thread not in self._readers:
+            self._readers[thread] = self.conn
+            self.thread = thread
+
+    def unbind(self):
+        if self.thread is not None and self._readers.get(self.thread) is self.conn:
+            del self._readers[self.thread]
+        self.thread = None
+
+
+# One writer connection guarded by a lock and a bounded set of read-only
+# connections that threads check out. The database runs in WAL mode so the
+# readers are not blocked while the writer commits. A `read_only` pool (e.g.
+# for a replica) has only the readers.
+class ConnectionPool:
+    def __init__(
+        self,
+        path: str,
+        readers=4,
+        busy_timeout=5.0,
+        mmap_size=256 * 1024 * 1024,
+        synchronous="NORMAL",
+        timeout=30.0,
+        cached_statements=128,
+        read_only=False,
+    ):
+        if path == ":memory:" or path.startswith("file::memory:"):
+            raise ValueError("A connection pool needs a database file")
+        if read_only and readers < 1:
+            raise ValueError("A read-only connection pool needs readers")
+
+        self.path = path
+        self.size = readers
+        self.busy_timeout = busy_timeout
+        self.mmap_size = mmap_size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.read_only = read_only
+
+        self.conn = None
+        if not read_only:
+            self.conn = self._connect(path)
+            self.conn.execute("PRAGMA journal_mode = WAL;")
+            self.conn.execute(f"PRAGMA synchronous = {synchronous};")
+
+        self._write_lock = threading.RLock()
+        self._local = threading.local()
+        # the reader each thread has checked out, by thread id
+        self._readers = {}
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+        self.in_use = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.writer_waits = 0
+        self.writer_wait_time = 0.0
+
+    def _connect(self, database: str, uri=False) -> sqlite3.Connection:
+        conn = sqlite3.Connection(
+            database,
+            timeout=self.busy_timeout,
+            check_same_thread=False,
+            uri=uri,
+            cached_statements=self.cached_statements,
+        )
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout * 1000)};")
+        conn.execute(f"PRAGMA mmap_size = {self.mmap_size};")
+        return conn
+
+    def _acquire_reader(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if create:
+            return self._connect(f"file:{self.path}?mode=ro", uri=True)
+
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError("No database connection available") from None
+        finally:
+            with self._lock:
+                self.waits += 1
+                self.wait_time += time.perf_counter() - start
+        return conn
+
+    @contextmanager
+    def reader(self, private=False):
+        # a thread inside a write transaction reads through the writer so it
+        # sees its own uncommitted changes
+        if getattr(self._local, "writing", 0):
+            yield self.conn
+            return
+
+        if self.size == 0:
+            with self.writer() as conn:
+                yield conn
+            return
+
+        # nested reads in the same thread (e.g. loading foreign keys while
+        # iterating) share the connection that is already checked out. A
+        # private reader is never shared, it may be held across yields of a
+        # generator that is resumed on other threads.
+        thread = threading.get_ident()
+        if not private:
+            conn = self._readers.get(thread)
+            if conn is not None:
+                yield conn
+                return
+
+        conn = self._acquire_reader()
+        if not private:
+            self._readers[thread] = conn
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+        try:
+            yield conn
+        finally:
+            # the thread that checked the reader out, not the current one
+            if not private:
+                del self._readers[thread]
+            with self._lock:
+                self.in_use -= 1
+            self._idle.put(conn)
+
+    def binding(self, conn: sqlite3.Connection) -> ReaderBinding:
+        return ReaderBinding(self._readers, conn)
+
+    @contextmanager
+    def writer(self):
+        if self.read_only:
+            # what sqlite raises for a write through a read-only connection
+            raise sqlite3.OperationalError("attempt to write a readonly database")
+        if not self._write_lock.acquire(blocking=False):
+            start = time.perf_counter()
+            if not self._write_lock.acquire(timeout=self.timeout):
+                raise TimeoutError("Database writer is busy")
+            with self._lock:
+                self.writer_waits += 1
+                self.writer_wait_time += time.perf_counter() - start
+
+        self._local.writing = getattr(self._local, "writing", 0) + 1
+        try:
+            yield self.conn
+        finally:
+            self._local.writing -= 1
+            self._write_lock.release()
+
+    def holds_writer(self) -> bool:
+        return getattr(self._local, "writing", 0) > 0
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": self._created,
+                "in_use": self.in_use,
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_time": self.wait_time,
+                "writer_waits": self.writer_waits,
+                "writer_wait_time": self.writer_wait_time,
+            }
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        if self.conn is not None:
+            self.conn.close()
@@ -0,0 +1,173 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import threading
+import time
+
+from .metrics import RequestTimer, _current_timer, current_timer
+from .middleware import Middleware
+
+
+# Keeps the last `max_records` slow or sampled requests on disk. Each record
+# holds the route and its kwargs and the timing. Sampled requests also keep
+# the SQL statements issued through Database and a cProfile summary next to
+# a `.prof` file for pstats or snakeviz. Requests that exceed `threshold`
+# without being sampled mark their route so its next request is profiled,
+# other requests run untouched. cProfile only sees the thread it runs on, so
+# under ASGI, where sync handlers run on worker threads next to unrelated
+# coroutines, sampled requests are recorded without a profile.
+class ProfilerMiddleware(Middleware):
+    def __init__(
+        self,
+        app,
+        directory="profiles",
+        threshold=0.5,
+        sample_rate=0.0,
+        max_records=100,
+        top=40,
+    ):
+        super().__init__(app)
+        self.directory = directory
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.max_records = max_records
+        self.top = top
+        self.slow_routes = set()
+
+        os.makedirs(directory, exist_ok=True)
+        self._slot = self._next_slot()
+        self._lock = threading.Lock()
+        # cProfile can only run one profiler at a time
+        self._profiling = threading.Lock()
+
+    def handle_request(self, request):
+        timer, token, start, profiler = self.begin(request, profile=True)
+        try:
+            response = super().handle_request(request)
+        finally:
+            self.end(token, profiler)
+        self.finish(request, response, timer, start, profiler)
+        return response
+
+    async def handle_request_async(self, request):
+        timer, token, start, profiler = self.begin(request, profile=False)
+        try:
+            response = await super().handle_request_async(request)
+        finally:
+            self.end(token, profiler)
+        self.finish(request, response, timer, start, profiler)
+        return response
+
+    def begin(self, request, profile: bool):
+        if not self.should_profile(request):
+            return None, None, time.perf_counter(), None
+
+        # reuse the timer of an outer MetricsMiddleware
+        timer = current_timer()
+        token = None
+        if timer is None:
+            timer = RequestTimer()
+            token = _current_timer.set(timer)
+        timer.statements = []
+
+        profiler = None
+        if profile and self._profiling.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            profiler.enable()
+        return timer, token, time.perf_counter(), profiler
+
+    def should_profile(self, request) -> bool:
+        if self.sample_rate and random.random() < self.sample_rate:
+            return True
+        if self.slow_routes:
+            return self.route(request)[0] in self.slow_routes
+        return False
+
+    def end(self, token, profiler):
+        if profiler is not None:
+            profiler.disable()
+            self._profiling.release()
+        if token is not None:
+            _current_timer.reset(token)
+
+    def finish(self, request, response, timer, start, profiler):
+        duration = time.perf_counter() - start
+        # only sampled requests have a timer collecting their statements
+        statements = None
+        if timer is not None:
+            statements = [
+                {"sql": sql, "duration": value} for sql, value in timer.statements
+            ]
+            timer.statements = None
+        elif duration < self.threshold:
+            return
+
+        route, kwargs = self.route(request)
+        if timer is None:
+            self.slow_routes.add(route)
+        else:
+            self.slow_routes.discard(route)
+
+        record = {
+            "time": time.time(),
+            "method": request.method,
+            "path": request.path,
+            "route": route,
+            "kwargs": {name: str(value) for name, value in kwargs.items()},
+            "status": response.status,
+            "duration": duration,
+            "statements": statements,
+            "profile": None,
+        }
+        if profiler is not None:
+            stream = io.StringIO()
+            stats = pstats.Stats(profiler, stream=stream)
+            stats.sort_stats("cumulative").print_stats(self.top)
+            record["profile"] = stream.getvalue()
+        self.write(record, profiler)
+
+    def route(self, request):
+        handler_data, kwargs = self.api.find_handler(request.path)
+        if handler_data is None:
+            return "<unmatched>", {}
+        return handler_data["path"], kwargs
+
+    def write(self, record: dict, profiler):
+        with self._lock:
+            slot = self._slot
+            self._slot = (slot + 1) % self.max_records
+
+        base = os.path.join(self.directory, f"profile-{slot:04d}")
+        tmp = f"{base}.json.tmp"
+        with open(tmp, "w") as f:
+            json.dump(record, f)
+        os.replace(tmp, f"{base}.json")
+
+        if profiler is not None:
+            profiler.dump_stats(f"{base}.prof")
+        elif os.path.exists(f"{base}.prof"):
+            # the slot's previous profile belongs to another request
+            os.remove(f"{base}.prof")
+
+    def records(self) -> list[dict]:
+        records = []
+        for name in os.listdir(self.directory):
+            if name.startswith("profile-") and name.endswith(".json"):
+                with open(os.path.join(self.directory, name)) as f:
+                    records.append(json.load(f))
+        records.sort(key=lambda record: record["time"])
+        return records
+
+    def _next_slot(self) -> int:
+        # continue after the newest record left by a previous process
+        newest, slot = None, 0
+        for name in os.listdir(self.directory):
+            if not (name.startswith("profile-") and name.endswith(".json")):
+                continue
+            mtime = os.path.getmtime(os.path.join(self.directory, name))
+            if newest is None or mtime > newest:
+                newest, slot = mtime, int(name[len("profile-") : -len(".json")]) + 1
+        return slot % self.max_records
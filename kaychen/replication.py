@@ -0,0 +1,217 @@
+import itertools
+import sqlite3
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from .middleware import Middleware
+from .orm import Database, Query, Table
+
+
+# Routes ORM calls between databases. Reads go round-robin to the read-only
+# replicas and writes to the primary. After a write, the same request (or,
+# outside of one, the same context for `sticky_seconds`) keeps reading from
+# the primary so it sees its own writes. Tables listed in `shards` live in
+# their own database file, which takes both their reads and their writes.
+# Related rows are loaded from the database the row was read from, so a
+# foreign key must reference a table stored in the same database, in either
+# direction. Shards are checked here, create() and migrate() check the
+# tables they are given and raise ValueError otherwise. Databases given
+# as paths are opened with a pool of `pool_size` readers (read-only ones for
+# replicas), so request threads read side by side and refresh() can run from
+# a background thread. A Database passed in is used as it is.
+class DatabaseRouter:
+    def __init__(
+        self,
+        primary,
+        replicas=(),
+        shards=None,
+        sticky_seconds=5.0,
+        pool_size=4,
+        **pool_options,
+    ):
+        self.pool_options = {"pool_size": pool_size, **pool_options}
+        self.primary = self._open(primary)
+        self.replicas = [self._open(replica, read_only=True) for replica in replicas]
+        self.shards = {
+            table: self._open(database) for table, database in (shards or {}).items()
+        }
+        self.sticky_seconds = sticky_seconds
+        for table in self.shards:
+            self._check_foreign_keys(table)
+
+        self.snapshots = {}
+        self._next_replica = itertools.cycle(range(len(self.replicas))).__next__
+        self._lock = threading.Lock()
+        self._last_write = ContextVar(f"kaychen_last_write_{id(self)}", default=None)
+        self._in_request = ContextVar(f"kaychen_in_request_{id(self)}", default=False)
+
+    @contextmanager
+    def request(self):
+        # stickiness starts fresh with every request and lasts until its end
+        last_write = self._last_write.set(None)
+        in_request = self._in_request.set(True)
+        try:
+            yield self
+        finally:
+            self._in_request.reset(in_request)
+            self._last_write.reset(last_write)
+
+    def _mark_write(self):
+        self._last_write.set(time.monotonic())
+
+    def is_sticky(self) -> bool:
+        last_write = self._last_write.get()
+        if last_write is None:
+            return False
+        if self._in_request.get():
+            return True
+        return time.monotonic() - last_write < self.sticky_seconds
+
+    def for_write(self, table: type[Table]) -> Database:
+        return self.shards.get(table, self.primary)
+
+    def for_read(self, table: type[Table]) -> Database:
+        shard = self.shards.get(table)
+        if shard is not None:
+            return shard
+        if not self.replicas or self.is_sticky():
+            return self.primary
+        with self._lock:
+            return self.replicas[self._next_replica()]
+
+    def add_snapshot(self, path: str) -> Database:
+        # a read-only copy of the primary, kept current with refresh()
+        self._copy_primary(path)
+        replica = self._open(path, read_only=True)
+        with self._lock:
+            self.snapshots[path] = replica
+            self.replicas.append(replica)
+            self._next_replica = itertools.cycle(range(len(self.replicas))).__next__
+        return replica
+
+    def refresh(self):
+        for path in list(self.snapshots):
+            self._copy_primary(path)
+
+    def _copy_primary(self, path: str):
+        target = sqlite3.connect(path)
+        try:
+            with self.primary.pool.reader() as source:
+                source.backup(target)
+        finally:
+            target.close()
+
+    def _check_foreign_keys(self, table: type[Table]):
+        database = self.for_write(table)
+        for name, fk in table._foreign_keys.values():
+            if self.for_write(fk.table) is not database:
+                raise ValueError(
+                    f"{table.__name__}.{name} references {fk.table.__name__}, "
+                    "which is stored in another database"
+                )
+
+    def create(self, table: type[Table]):
+        self._check_foreign_keys(table)
+        self.for_write(table).create(table)
+
+    def migrate(self, *tables: type[Table]) -> list[str]:
+        for table in tables:
+            self._check_foreign_keys(table)
+        statements = []
+        for database, group in self._group_by_database(tables).items():
+            statements.extend(database.migrate(*group))
+        return statements
+
+    def save(self, instance: Table):
+        self.for_write(type(instance)).save(instance)
+        self._mark_write()
+
+    def save_many(self, instances):
+        # one call and one transaction per database
+        for database, group in self._group_instances(instances).items():
+            database.save_many(group)
+        self._mark_write()
+
+    def update(self, instance: Table):
+        self.for_write(type(instance)).update(instance)
+        self._mark_write()
+
+    def update_many(self, instances):
+        for database, group in self._group_instances(instances).items():
+            database.update_many(group)
+        self._mark_write()
+
+    def delete(self, table: type[Table], id):
+        self.for_write(table).delete(table, id)
+        self._mark_write()
+
+    def delete_many(self, table: type[Table], ids):
+        self.for_write(table).delete_many(table, ids)
+        self._mark_write()
+
+    def get(self, table: type[Table], id=None, lazy=False):
+        return self.for_read(table).get(table, id=id, lazy=lazy)
+
+    def all(self, table: type[Table], lazy=False):
+        return self.for_read(table).all(table, lazy=lazy)
+
+    def iter(self, table: type[Table], batch_size=100, after_id=None, lazy=False):
+        return self.for_read(table).iter(table, batch_size, after_id, lazy)
+
+    def page(self, table: type[Table], after_id=None, limit=100, lazy=False):
+        return self.for_read(table).page(table, after_id, limit, lazy)
+
+    def rows(self, table: type[Table]) -> list[tuple]:
+        return self.for_read(table).rows(table)
+
+    def query(self, table: type[Table], lazy=False) -> Query:
+        return self.for_read(table).query(table, lazy)
+
+    @property
+    def databases(self) -> list[Database]:
+        return [self.primary, *self.replicas, *self.shards.values()]
+
+    @contextmanager
+    def session(self):
+        with ExitStack() as stack:
+            for database in self.databases:
+                stack.enter_context(database.session())
+            yield self
+
+    def _group_by_database(self, tables) -> dict[Database, list[type[Table]]]:
+        groups = {}
+        for table in tables:
+            groups.setdefault(self.for_write(table), []).append(table)
+        return groups
+
+    def _group_instances(self, instances) -> dict[Database, list[Table]]:
+        groups = {}
+        for instance in instances:
+            groups.setdefault(self.for_write(type(instance)), []).append(instance)
+        return groups
+
+    def _open(self, database, read_only=False) -> Database:
+        if isinstance(database, Database):
+            return database
+        return Database(database, read_only=read_only, **self.pool_options)
+
+    def close(self):
+        for database in self.databases:
+            database.close()
+
+
+# Scopes read-your-writes stickiness to each request.
+class RouterMiddleware(Middleware):
+    def __init__(self, app, router: DatabaseRouter):
+        super().__init__(app)
+        self.router = router
+
+    def handle_request(self, request):
+        with self.router.request():
+            return super().handle_request(request)
+
+    async def handle_request_async(self, request):
+        with self.router.request():
+            return await super().handle_request_async(request)
@@ -0,0 +1,36 @@
+from urllib.parse import quote
+
+from webob import Request as WebobRequest
+
+PATH_SAFE = "/~!$&'()*+,;=:@"
+
+
+# Thin wrapper around the WSGI environ. `path` and `method` are read straight
+# from the environ, everything else is delegated to a webob Request that is
+# only built when a handler actually needs it.
+class Request:
+    def __init__(self, environ):
+        self.environ = environ
+        self._path = None
+        self._webob = None
+
+    @property
+    def path(self) -> str:
+        if self._path is None:
+            environ = self.environ
+            raw = environ.get("SCRIPT_NAME", "") + environ.get("PATH_INFO", "")
+            self._path = quote(raw.encode("latin1"), safe=PATH_SAFE)
+        return self._path
+
+    @property
+    def method(self) -> str:
+        return self.environ["REQUEST_METHOD"]
+
+    @property
+    def webob(self) -> WebobRequest:
+        if self._webob is None:
+            self._webob = WebobRequest(self.environ)
+        return self._webob
+
+    def __getattr__(self, name):
+        return getattr(self.webob, name)
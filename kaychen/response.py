@@ -1,37 +1,196 @@
-from typing import Iterable
-from webob import Response
+from dataclasses import asdict, is_dataclass
+from datetime import date, time
+from decimal import Decimal
+from http import HTTPStatus
+from typing import Callable, Iterable, Iterator
+from uuid import UUID
 from wsgiref.types import WSGIEnvironment, StartResponse
 import json
 
+STATUS_LINES = {
+    status.value: f"{status.value} {status.phrase}" for status in HTTPStatus
+}
+NO_BODY_STATUSES = ("204 No Content", "304 Not Modified")
+
 
 class CustomResponse:
-    def __init__(self):
+    def __init__(self, json_dumps: Callable[..., bytes] = None):
+        self.json_dumps = json_dumps or default_json_dumps
         self.json = None
         self.content_type = None
         self.status_code = 200
         self.body = ""
         self.html = None
         self.text = None
+        self.json_stream = None
+        self.json_bytes = None
+        self.headers = {}
+        self.cache_entry = None
 
     def __call__(
         self, environ: WSGIEnvironment, start_response: StartResponse
     ) -> Iterable[bytes]:
         self.set_body_and_content_type()
 
-        response = Response(
-            body=self.body, content_type=self.content_type, status=f"{self.status_code}"
-        )
-        return response(environ, start_response)
+        status = self.status
+        if status in NO_BODY_STATUSES:
+            start_response(status, list(self.headers.items()))
+            return []
+
+        body = self.body
+        headers = [("Content-Type", self.get_content_type_header())]
+        headers.extend(self.headers.items())
+
+        if isinstance(body, str):
+            body = body.encode("UTF-8")
+        if isinstance(body, bytes):
+            headers.append(("Content-Length", str(len(body))))
+            body = [body]
+        # otherwise there is no Content-Length, the server sends the
+        # iterable chunked
+
+        start_response(status, headers)
+
+        if environ["REQUEST_METHOD"] == "HEAD":
+            if hasattr(body, "close"):
+                body.close()
+            return []
+        return body
+
+    @property
+    def status(self) -> str:
+        status_code = self.status_code
+        if isinstance(status_code, str):
+            if " " in status_code:
+                return status_code
+            status_code = int(status_code)
+        return STATUS_LINES.get(status_code, f"{status_code} Unknown")
+
+    def get_content_type_header(self) -> str:
+        content_type = self.content_type or "text/html"
+        if content_type.startswith("text/") and "charset=" not in content_type:
+            content_type += "; charset=UTF-8"
+        return content_type
+
+    def prepare(self):
+        # resolves the json/html/text helpers into body and content_type
+        # once, so middleware can rewrite the body before it is sent
+        self.set_body_and_content_type()
+        self.json = self.json_bytes = self.json_stream = None
+        self.html = self.text = None
 
     def set_body_and_content_type(self):
         if self.json is not None:
-            self.body = json.dumps(self.json).encode("UTF-8")
+            self.body = self.json_dumps(self.json)
+            self.content_type = "application/json"
+
+        if self.json_bytes is not None:
+            self.body = self.json_bytes
+            self.content_type = "application/json"
+
+        if self.json_stream is not None:
+            self.body = iter_json_array(self.json_stream, dumps=self.json_dumps)
             self.content_type = "application/json"
 
         if self.html is not None:
             self.content_type = "text/html"
-            self.body = self.html.encode()
+            if isinstance(self.html, str):
+                self.body = self.html.encode()
+            else:
+                self.body = encode_chunks(self.html)
 
         if self.text is not None:
-            self.body = self.text
             self.content_type = "text/plain"
+            if isinstance(self.text, str):
+                self.body = self.text
+            else:
+                self.body = encode_chunks(self.text)
+
+
+def encode_chunks(chunks: Iterable[str]) -> Iterator[bytes]:
+    for chunk in chunks:
+        if chunk:
+            yield chunk.encode("UTF-8")
+
+
+def iter_json_array(
+    items: Iterable, chunk_size=64 * 1024, dumps: Callable[..., bytes] = None
+) -> Iterator[bytes]:
+    dumps = dumps or default_json_dumps
+    buffer = [b"["]
+    buffered = 1
+    separator = b""
+    for item in items:
+        encoded = separator + dumps(item)
+        separator = b","
+        buffer.append(encoded)
+        buffered += len(encoded)
+        if buffered >= chunk_size:
+            yield b"".join(buffer)
+            buffer = []
+            buffered = 0
+    buffer.append(b"]")
+    yield b"".join(buffer)
+
+
+def json_default(obj):
+    # objects can provide their own JSON form, ORM rows and queries do
+    to_json = getattr(type(obj), "__json__", None)
+    if to_json is not None:
+        return to_json(obj)
+    if is_dataclass(obj) and not isinstance(obj, type):
+        return asdict(obj)
+    if isinstance(obj, (date, time)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, (Decimal, UUID)):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def get_json_dumps(backend=None) -> Callable[..., bytes]:
+    # returns a function encoding an object to JSON bytes, by default with
+    # the fastest installed library
+    if callable(backend):
+        return backend
+
+    if backend is None:
+        for name in ("orjson", "ujson"):
+            try:
+                return get_json_dumps(name)
+            except ImportError:
+                continue
+        backend = "json"
+
+    if backend == "orjson":
+        import orjson
+
+        option = orjson.OPT_NON_STR_KEYS
+
+        def dumps(obj):
+            return orjson.dumps(obj, default=json_default, option=option)
+
+    elif backend == "ujson":
+        import ujson
+
+        def dumps(obj):
+            return ujson.dumps(
+                obj,
+                default=json_default,
+                ensure_ascii=False,
+                escape_forward_slashes=False,
+            ).encode("UTF-8")
+
+    elif backend == "json":
+
+        def dumps(obj):
+            return json.dumps(obj, default=json_default).encode("UTF-8")
+
+    else:
+        raise ValueError(f"Unknown JSON backend {backend}")
+
+    return dumps
+
+
+default_json_dumps = get_json_dumps("json")
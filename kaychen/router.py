@@ -0,0 +1,129 @@
+import re
+import threading
+from collections import OrderedDict
+
+from parse import compile as compile_pattern
+
+PLAIN_PARAM_RE = re.compile(r"^\{([A-Za-z_][A-Za-z0-9_]*)\}$")
+
+
+class _Node:
+    __slots__ = ("static", "params", "route")
+
+    def __init__(self):
+        self.static = {}
+        self.params = []
+        self.route = None
+
+
+class _Param:
+    __slots__ = ("segment", "name", "parser", "node")
+
+    def __init__(self, segment: str):
+        self.segment = segment
+        self.node = _Node()
+
+        match = PLAIN_PARAM_RE.match(segment)
+        if match is not None:
+            self.name = match.group(1)
+            self.parser = None
+        else:
+            self.name = None
+            self.parser = compile_pattern(segment)
+
+    def match(self, segment: str):
+        if self.parser is None:
+            if segment:
+                return {self.name: segment}
+            return None
+
+        res = self.parser.parse(segment)
+        if res is None:
+            return None
+        return res.named
+
+
+# Segment trie of route patterns, compiled once in `add`. Static segments are
+# tried before parameters, parameters in the order their routes were added.
+class Router:
+    def __init__(self, cache_size=1024):
+        self.root = _Node()
+        self.static_routes = {}
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        # request threads share the cache
+        self._lock = threading.Lock()
+
+    def add(self, path: str, route):
+        with self._lock:
+            self._cache.clear()
+
+        if "{" not in path:
+            self.static_routes[path] = route
+            return
+
+        node = self.root
+        for segment in path.split("/"):
+            if "{" not in segment:
+                node = node.static.setdefault(segment, _Node())
+                continue
+
+            for param in node.params:
+                if param.segment == segment:
+                    break
+            else:
+                param = _Param(segment)
+                node.params.append(param)
+            node = param.node
+
+        node.route = route
+
+    def match(self, path: str):
+        route = self.static_routes.get(path)
+        if route is not None:
+            return route, {}
+
+        cache = self._cache
+        with self._lock:
+            entry = cache.get(path)
+            if entry is not None:
+                cache.move_to_end(path)
+
+        if entry is not None:
+            route, kwargs = entry
+        else:
+            kwargs = {}
+            route = self._match(self.root, path.split("/"), 0, kwargs)
+            if route is None:
+                kwargs = None
+            with self._lock:
+                cache[path] = (route, kwargs)
+                if len(cache) > self.cache_size:
+                    cache.popitem(last=False)
+
+        if route is None:
+            return None, None
+        return route, dict(kwargs)
+
+    def _match(self, node: _Node, segments: list[str], index: int, kwargs: dict):
+        if index == len(segments):
+            return node.route
+
+        segment = segments[index]
+
+        child = node.static.get(segment)
+        if child is not None:
+            route = self._match(child, segments, index + 1, kwargs)
+            if route is not None:
+                return route
+
+        for param in node.params:
+            named = param.match(segment)
+            if named is None:
+                continue
+            route = self._match(param.node, segments, index + 1, kwargs)
+            if route is not None:
+                kwargs.update(named)
+                return route
+
+        return None
@@ -0,0 +1,170 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from kaychen.aio import AsyncDatabase
+from kaychen.orm import Column, ForeignKey, Table
+
+
+class Writer(Table):
+    name = Column(str, unique=True)
+
+
+class Essay(Table):
+    title = Column(str)
+    writer = ForeignKey(Writer)
+
+
+def run(coroutine_function, tmp_path):
+    async def main():
+        db = AsyncDatabase(str(tmp_path / "async.db"))
+        await db.create(Writer)
+        await db.create(Essay)
+        try:
+            return await coroutine_function(db)
+        finally:
+            await db.close()
+
+    return asyncio.run(main())
+
+
+def test_async_reads_and_writes(tmp_path):
+    async def scenario(db):
+        ann = Writer(name="Ann")
+        await db.save(ann)
+        await db.save_many([Essay(title=f"essay {i}", writer=ann) for i in range(5)])
+
+        assert (await db.get(Writer, id=ann.id)).name == "Ann"
+        essays = await db.all(Essay)
+        assert [essay.writer.name for essay in essays] == ["Ann"] * 5
+        assert await db.query(Essay).filter(title__gte="essay 3").count() == 2
+        assert (await db.query(Essay).order_by("-id").first()).title == "essay 4"
+
+        titles = [essay.title async for essay in db.iter(Essay, batch_size=2)]
+        assert titles == [f"essay {i}" for i in range(5)]
+
+        with pytest.raises(LookupError):
+            await db.get(Writer, id=42)
+
+    run(scenario, tmp_path)
+
+
+def test_concurrent_small_writes_are_committed_together(tmp_path):
+    async def scenario(db):
+        writers = [Writer(name=f"writer {i}") for i in range(20)]
+        writers.append(Writer(name="writer 3"))
+
+        # keep the database thread busy so the saves queue up behind it
+        busy = db.run(lambda database: time.sleep(0.05))
+        results = await asyncio.gather(
+            busy, *[db.save(writer) for writer in writers], return_exceptions=True
+        )
+
+        assert isinstance(results[-1], sqlite3.IntegrityError)
+        assert all(result is None for result in results[:-1])
+        assert db.batches >= 1 and db.batched_writes > 1
+        assert len(await db.all(Writer)) == 20
+        assert len({writer.id for writer in writers[:-1]}) == 20
+
+    run(scenario, tmp_path)
+
+
+def test_async_transactions_roll_back_and_isolate(tmp_path):
+    async def scenario(db):
+        events = []
+
+        async def outside():
+            await asyncio.sleep(0.01)
+            await db.save(Writer(name="outside"))
+            events.append("outside saved")
+
+        async def inside():
+            with pytest.raises(RuntimeError):
+                async with db.transaction():
+                    await db.save(Writer(name="rolled back"))
+                    await asyncio.sleep(0.05)
+                    events.append("transaction done")
+                    raise RuntimeError("abort")
+
+            async with db.transaction():
+                await db.save(Writer(name="kept"))
+
+        await asyncio.gather(inside(), outside())
+
+        assert events == ["transaction done", "outside saved"]
+        names = sorted(writer.name for writer in await db.all(Writer))
+        assert names == ["kept", "outside"]
+
+    run(scenario, tmp_path)
+
+
+def test_lazy_rows_are_rejected(tmp_path):
+    async def scenario(db):
+        with pytest.raises(ValueError):
+            await db.get(Writer, 1, lazy=True)
+        with pytest.raises(ValueError):
+            db.query(Essay, lazy=True)
+        with pytest.raises(ValueError):
+            db.iter(Essay, lazy=True)
+
+    run(scenario, tmp_path)
+
+
+def test_failed_batch_fails_every_write(tmp_path):
+    async def scenario(db):
+        database = db.database
+        transaction = database.transaction
+
+        def broken():
+            raise sqlite3.OperationalError("disk I/O error")
+
+        def block(database):
+            time.sleep(0.05)
+            database.transaction = broken
+
+        busy = db.run(block)
+        saves = [db.save(Writer(name=f"writer {i}")) for i in range(5)]
+        results = await asyncio.wait_for(
+            asyncio.gather(busy, *saves, return_exceptions=True), timeout=2
+        )
+        database.transaction = transaction
+
+        assert all(
+            isinstance(result, sqlite3.OperationalError) for result in results[1:]
+        )
+        assert await db.all(Writer) == []
+
+    run(scenario, tmp_path)
+
+
+def test_cancelled_transaction_is_ended(tmp_path):
+    async def scenario(db):
+        begin = db._begin
+        started = threading.Event()
+
+        def slow_begin(owner):
+            started.set()
+            time.sleep(0.05)
+            begin(owner)
+
+        db._begin = slow_begin
+
+        async def transaction():
+            async with db.transaction():
+                await db.save(Writer(name="never"))
+
+        task = asyncio.create_task(transaction())
+        await asyncio.to_thread(started.wait)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # the transaction was ended, other callers are not deferred forever
+        await asyncio.wait_for(db.save(Writer(name="after")), timeout=2)
+        assert [writer.name for writer in await db.all(Writer)] == ["after"]
+        assert db._owner is None
+
+    run(scenario, tmp_path)
@@ -0,0 +1,120 @@
+import time
+
+import pytest
+import requests
+
+from kaychen.api import API
+from kaychen.cache import CacheMiddleware
+
+
+@pytest.fixture
+def calls(app: API):
+    calls = []
+
+    @app.route("/cached", cache=60)
+    def cached(req, resp):
+        calls.append("cached")
+        resp.json = {"calls": len(calls)}
+
+    @app.route("/short", cache=0.05)
+    def short(req, resp):
+        calls.append("short")
+        resp.text = f"short {len(calls)}"
+
+    @app.route("/uncached")
+    def uncached(req, resp):
+        calls.append("uncached")
+        resp.text = "uncached"
+
+    return calls
+
+
+def test_cached_route_runs_handler_once(app: API, test_client: requests.Session, calls):
+    app.add_middleware(CacheMiddleware)
+
+    first = test_client.get("http://testserver/cached")
+    second = test_client.get("http://testserver/cached")
+
+    assert first.json() == second.json() == {"calls": 1}
+    assert second.headers["Content-Type"] == "application/json"
+    assert first.headers["ETag"] == second.headers["ETag"]
+    assert "Last-Modified" in second.headers
+
+    test_client.get("http://testserver/uncached")
+    test_client.get("http://testserver/uncached")
+    test_client.post("http://testserver/cached")
+    assert calls == ["cached", "uncached", "uncached", "cached"]
+
+
+def test_conditional_get_returns_not_modified(
+    app: API, test_client: requests.Session, calls
+):
+    app.add_middleware(CacheMiddleware)
+    etag = test_client.get("http://testserver/cached").headers["ETag"]
+    last_modified = test_client.get("http://testserver/cached").headers["Last-Modified"]
+
+    response = test_client.get(
+        "http://testserver/cached", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+    response = test_client.get(
+        "http://testserver/cached", headers={"If-Modified-Since": last_modified}
+    )
+    assert response.status_code == 304
+
+    response = test_client.get(
+        "http://testserver/cached", headers={"If-None-Match": '"other"'}
+    )
+    assert response.status_code == 200
+    assert calls == ["cached"]
+
+
+def test_entries_expire_and_are_evicted(app: API, test_client: requests.Session, calls):
+    app.add_middleware(CacheMiddleware, max_entries=1)
+
+    assert test_client.get("http://testserver/short").text == "short 1"
+    assert test_client.get("http://testserver/short").text == "short 1"
+    time.sleep(0.06)
+    assert test_client.get("http://testserver/short").text == "short 2"
+
+    test_client.get("http://testserver/cached")
+    assert test_client.get("http://testserver/short").text == "short 4"
+
+
+def test_default_ttl_and_vary_headers(app: API, test_client: requests.Session, calls):
+    app.add_middleware(CacheMiddleware, ttl=60, vary=("Accept-Language",))
+
+    test_client.get("http://testserver/uncached")
+    test_client.get("http://testserver/uncached")
+    test_client.get("http://testserver/uncached", headers={"Accept-Language": "de"})
+
+    assert calls == ["uncached", "uncached"]
+
+
+def test_responses_setting_cookies_are_not_cached(
+    app: API, test_client: requests.Session
+):
+    app.add_middleware(CacheMiddleware)
+    users = iter(["user1", "user2"])
+
+    @app.route("/login", cache=60)
+    def login(req, resp):
+        resp.headers["Set-Cookie"] = f"session={next(users)}"
+        resp.text = "welcome"
+
+    assert test_client.get("http://testserver/login").cookies["session"] == "user1"
+    assert test_client.get("http://testserver/login").cookies["session"] == "user2"
+
+
+def test_cached_responses_name_the_vary_headers(
+    app: API, test_client: requests.Session, calls
+):
+    app.add_middleware(CacheMiddleware, vary=("Accept", "Accept-Language"))
+
+    first = test_client.get("http://testserver/cached")
+    second = test_client.get("http://testserver/cached")
+
+    assert first.headers["Vary"] == second.headers["Vary"] == "Accept, Accept-Language"
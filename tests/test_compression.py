@@ -0,0 +1,118 @@
+import gzip
+
+import pytest
+import requests
+
+from kaychen.api import API
+from kaychen.cache import CacheMiddleware
+from kaychen.compression import CompressionMiddleware, parse_accept_encoding
+
+LONG_TEXT = "kaychen " * 200
+
+
+@pytest.fixture
+def routes(app: API):
+    @app.route("/long", cache=60)
+    def long(req, resp):
+        resp.text = LONG_TEXT
+
+    @app.route("/short")
+    def short(req, resp):
+        resp.text = "short"
+
+    @app.route("/stream")
+    def stream(req, resp):
+        resp.text = (LONG_TEXT for _ in range(3))
+
+    @app.route("/image")
+    def image(req, resp):
+        resp.body = b"\x89PNG" * 500
+        resp.content_type = "image/png"
+
+
+def _get(test_client, path, encoding="gzip"):
+    return test_client.get(
+        f"http://testserver{path}",
+        headers={"Accept-Encoding": encoding},
+        stream=True,
+    )
+
+
+def test_gzip_compression(app: API, test_client: requests.Session, routes):
+    app.add_middleware(CompressionMiddleware, level=9)
+
+    response = _get(test_client, "/long")
+    raw = response.raw.read()
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert int(response.headers["Content-Length"]) == len(raw) < len(LONG_TEXT)
+    assert gzip.decompress(raw).decode() == LONG_TEXT
+
+
+def test_small_and_compressed_bodies_are_skipped(
+    app: API, test_client: requests.Session, routes
+):
+    app.add_middleware(CompressionMiddleware)
+
+    assert "Content-Encoding" not in _get(test_client, "/short").headers
+    assert "Content-Encoding" not in _get(test_client, "/image").headers
+    assert "Content-Encoding" not in _get(test_client, "/long", "identity").headers
+    assert "Content-Encoding" not in _get(test_client, "/long", "gzip;q=0").headers
+
+
+def test_streamed_body_is_compressed_incrementally(
+    app: API, test_client: requests.Session, routes
+):
+    app.add_middleware(CompressionMiddleware)
+
+    response = _get(test_client, "/stream")
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    assert gzip.decompress(response.raw.read()).decode() == LONG_TEXT * 3
+
+
+def test_compressed_variants_are_cached(
+    app: API, test_client: requests.Session, routes
+):
+    app.add_middleware(CacheMiddleware)
+    app.add_middleware(CompressionMiddleware)
+    cache = app.middleware.app.app
+
+    first = _get(test_client, "/long")
+    second = _get(test_client, "/long")
+    plain = _get(test_client, "/long", "identity")
+
+    (entry,) = cache.entries.values()
+    assert list(entry.variants) == ["gzip"]
+    assert first.raw.read() == second.raw.read() == entry.variants["gzip"]
+    assert plain.raw.read() == LONG_TEXT.encode()
+    assert first.headers["ETag"] == "W/" + plain.headers["ETag"]
+
+
+def test_not_modified_keeps_the_headers_of_the_compressed_response(
+    app: API, test_client: requests.Session, routes
+):
+    app.add_middleware(CacheMiddleware)
+    app.add_middleware(CompressionMiddleware)
+
+    first = _get(test_client, "/long")
+    response = test_client.get(
+        "http://testserver/long",
+        headers={"Accept-Encoding": "gzip", "If-None-Match": first.headers["ETag"]},
+    )
+
+    assert response.status_code == 304
+    assert response.headers["ETag"] == first.headers["ETag"]
+    assert response.headers["Vary"] == first.headers["Vary"]
+    assert first.headers["Vary"] == "Accept, Accept-Encoding"
+    assert "Content-Encoding" not in response.headers
+
+
+def test_parse_accept_encoding():
+    assert parse_accept_encoding("gzip, br;q=0.5, *;q=0") == {
+        "gzip": 1.0,
+        "br": 0.5,
+        "*": 0.0,
+    }
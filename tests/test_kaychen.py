@@ -1,10 +1,20 @@
+import asyncio
+import datetime
+import json
 import pathlib
+import random
+import sys
+import threading
+from dataclasses import dataclass
 
 import pytest
 import requests
 
 from kaychen.api import API
 from kaychen.middleware import Middleware
+from kaychen.response import CustomResponse as Response
+from kaychen.response import iter_json_array
+from kaychen.router import Router
 
 
 def test_template_inside_handler(app: API, test_client: requests.Session):
@@ -254,3 +264,407 @@ def test_manually_setting_body(app: API, test_client: requests.Session):
 
     assert "text/plain" in response.headers["Content-Type"]
     assert response.text == "Byte Body"
+
+
+def test_typed_route_parameters(app: API, test_client: requests.Session):
+    @app.route("/sum/{num_1:d}/{num_2:d}")
+    def sum_handler(req, resp, num_1, num_2):
+        resp.text = f"{num_1 + num_2}"
+
+    assert test_client.get("http://testserver/sum/3/4").text == "7"
+    assert test_client.get("http://testserver/sum/3/four").status_code == 404
+
+
+def test_static_route_is_preferred_over_parameter(
+    app: API, test_client: requests.Session
+):
+    @app.route("/{name}")
+    def greeting(req, resp, name):
+        resp.text = f"Hello, {name}"
+
+    @app.route("/home")
+    def home(req, resp):
+        resp.text = "Home"
+
+    assert test_client.get("http://testserver/home").text == "Home"
+    assert test_client.get("http://testserver/carla").text == "Hello, carla"
+
+
+def test_route_matching_backtracks_to_parameter(app: API):
+    def books(req, resp):
+        pass
+
+    def book_reviews(req, resp, id):
+        pass
+
+    app.add_route("/books/new", books)
+    app.add_route("/books/{id:d}/reviews", book_reviews)
+
+    handler_data, kwargs = app.find_handler("/books/12/reviews")
+    assert handler_data["handler"] is book_reviews
+    assert kwargs == {"id": 12}
+
+    # resolved paths are cached, the cached kwargs must not leak
+    kwargs["id"] = 0
+    assert app.find_handler("/books/12/reviews")[1] == {"id": 12}
+
+    assert app.find_handler("/books/new/reviews") == (None, None)
+    assert app.find_handler("/books") == (None, None)
+
+
+def _asgi_request(app: API, method: str, path: str, body: bytes = b""):
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": b"",
+        "headers": [(b"host", b"testserver")],
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app.asgi(scope, receive, send))
+
+    start = sent[0]
+    body = b"".join(m.get("body", b"") for m in sent[1:])
+    return start["status"], dict(start["headers"]), body
+
+
+def test_asgi_async_function_handler(app: API):
+    @app.route("/hello/{name}")
+    async def greeting(req, resp, name):
+        await asyncio.sleep(0)
+        resp.text = f"Hello, {name}"
+
+    status, headers, body = _asgi_request(app, "GET", "/hello/carla")
+
+    assert status == 200
+    assert b"text/plain" in headers[b"content-type"]
+    assert body == b"Hello, carla"
+
+
+def test_asgi_class_based_async_handler(app: API):
+    @app.route("/book")
+    class BookResource:
+        async def post(self, req, resp):
+            resp.json = {"title": req.json["title"]}
+
+    status, _, body = _asgi_request(app, "POST", "/book", b'{"title": "ORM"}')
+
+    assert status == 200
+    assert json.loads(body) == {"title": "ORM"}
+
+
+def test_asgi_sync_handler_runs_in_thread_pool(app: API):
+    @app.route("/thread")
+    def thread_handler(req, resp):
+        resp.text = threading.current_thread().name
+
+    _, _, body = _asgi_request(app, "GET", "/thread")
+
+    assert body.decode() != threading.current_thread().name
+
+
+def test_asgi_middleware_exception_handler_and_allowed_methods(app: API):
+    called = []
+
+    class RecordingMiddleware(Middleware):
+        def process_request(self, req):
+            called.append("request")
+
+        def process_response(self, req, res):
+            called.append("response")
+
+    app.add_middleware(RecordingMiddleware)
+
+    @app.route("/home", allowed_methods=["post"])
+    async def home(req, resp):
+        resp.text = "Hello"
+
+    with pytest.raises(AttributeError):
+        _asgi_request(app, "GET", "/home")
+
+    async def on_exception(req, resp, exc):
+        resp.text = "handled"
+
+    app.add_exception_handler(on_exception)
+
+    assert _asgi_request(app, "GET", "/home")[2] == b"handled"
+    assert _asgi_request(app, "POST", "/home")[2] == b"Hello"
+    assert _asgi_request(app, "GET", "/missing")[0] == 404
+    assert called.count("request") == 4
+    assert called.count("response") == 3
+
+
+def test_async_handler_under_wsgi(app: API, test_client: requests.Session):
+    @app.route("/async")
+    async def async_handler(req, resp):
+        resp.text = "awaited"
+
+    assert test_client.get("http://testserver/async").text == "awaited"
+
+
+def test_streamed_body(app: API, test_client: requests.Session):
+    @app.route("/export")
+    def export(req, resp):
+        resp.body = (f"{i},row {i}\n".encode() for i in range(3))
+        resp.content_type = "text/csv"
+
+    response = test_client.get("http://testserver/export")
+
+    assert "Content-Length" not in response.headers
+    assert "text/csv" in response.headers["Content-Type"]
+    assert response.text == "0,row 0\n1,row 1\n2,row 2\n"
+
+
+def test_streamed_json_array(app: API, test_client: requests.Session):
+    @app.route("/items")
+    def items(req, resp):
+        resp.json_stream = ({"id": i} for i in range(3))
+
+    response = test_client.get("http://testserver/items")
+
+    assert response.headers["Content-Type"] == "application/json"
+    assert response.json() == [{"id": 0}, {"id": 1}, {"id": 2}]
+
+
+def test_streamed_json_array_chunks():
+    chunks = list(iter_json_array(range(1000), chunk_size=100))
+
+    assert len(chunks) > 1
+    assert json.loads(b"".join(chunks)) == list(range(1000))
+    assert b"".join(iter_json_array([])) == b"[]"
+
+
+def test_streamed_template(app: API, test_client: requests.Session):
+    @app.route("/html")
+    def html_handler(req, resp):
+        resp.html = app.template(
+            "index.html",
+            context={"title": "Best Title", "name": "Best Name"},
+            stream=True,
+        )
+
+    response = test_client.get("http://testserver/html")
+
+    assert "Content-Length" not in response.headers
+    assert "text/html" in response.headers["Content-Type"]
+    assert "Best Title" in response.text
+
+
+def test_asgi_streamed_body(app: API):
+    @app.route("/export")
+    def export(req, resp):
+        resp.text = (f"line {i}\n" for i in range(2))
+
+    status, headers, body = _asgi_request(app, "GET", "/export")
+
+    assert status == 200
+    assert b"content-length" not in headers
+    assert body == b"line 0\nline 1\n"
+
+
+def test_middleware_hooks_run_in_nesting_order(app: API, test_client: requests.Session):
+    calls = []
+
+    def recording(name):
+        class RecordingMiddleware(Middleware):
+            def process_request(self, req):
+                calls.append(f"{name} request")
+
+            def process_response(self, req, res):
+                calls.append(f"{name} response")
+
+        return RecordingMiddleware
+
+    class NoOpMiddleware(Middleware):
+        pass
+
+    @app.route("/")
+    def index(req, resp):
+        calls.append("handler")
+
+    app.add_middleware(recording("inner"))
+    app.add_middleware(NoOpMiddleware)
+    test_client.get("http://testserver/")
+    app.add_middleware(recording("outer"))
+    calls.clear()
+    test_client.get("http://testserver/")
+
+    assert calls == [
+        "outer request",
+        "inner request",
+        "handler",
+        "inner response",
+        "outer response",
+    ]
+    process_request_hooks, process_response_hooks, _ = app.middleware.chain
+    assert len(process_request_hooks) == 2
+    assert len(process_response_hooks) == 2
+
+
+def test_middleware_overriding_handle_request(app: API, test_client: requests.Session):
+    class ShortCircuitMiddleware(Middleware):
+        def handle_request(self, request):
+            if request.path == "/blocked":
+                response = Response()
+                response.status_code = 403
+                return response
+            return super().handle_request(request)
+
+    class HeaderMiddleware(Middleware):
+        def process_response(self, req, res):
+            res.text = res.text + "!"
+
+    app.add_middleware(HeaderMiddleware)
+    app.add_middleware(ShortCircuitMiddleware)
+
+    @app.route("/{name}")
+    def greeting(req, resp, name):
+        resp.text = f"Hello, {name}"
+
+    assert test_client.get("http://testserver/blocked").status_code == 403
+    assert test_client.get("http://testserver/carla").text == "Hello, carla!"
+
+
+def test_request_wraps_environ_lazily(app: API, test_client: requests.Session):
+    seen = {}
+
+    @app.route("/search")
+    def search(req, resp):
+        seen["built_before_params"] = req._webob is not None
+        resp.text = req.params["q"]
+
+    response = test_client.get("http://testserver/search?q=orm")
+
+    assert response.text == "orm"
+    assert seen["built_before_params"] is False
+
+
+def test_head_request_has_no_body(app: API, test_client: requests.Session):
+    @app.route("/text", allowed_methods=["get", "head"])
+    def text_handler(req, resp):
+        resp.text = "some text"
+
+    response = test_client.head("http://testserver/text")
+
+    assert response.headers["Content-Length"] == "9"
+    assert response.content == b""
+
+
+@dataclass
+class Point:
+    x: int
+    created: datetime.date
+
+
+def test_json_response_encodes_dataclasses_and_dates(
+    app: API, test_client: requests.Session
+):
+    @app.route("/point")
+    def point(req, resp):
+        resp.json = {"point": Point(1, datetime.date(2024, 1, 17)), "tags": {"a"}}
+
+    assert test_client.get("http://testserver/point").json() == {
+        "point": {"x": 1, "created": "2024-01-17"},
+        "tags": ["a"],
+    }
+
+
+def test_json_backend_is_configurable():
+    app = API(templates_dir="tests/templates", json_backend="json")
+
+    @app.route("/json")
+    def json_handler(req, resp):
+        resp.json = {"name": "bubmo"}
+
+    response = app.test_session().get("http://testserver/json")
+    assert response.content == b'{"name": "bubmo"}'
+
+    with pytest.raises(ValueError):
+        API(json_backend="yaml")
+
+
+def test_pre_serialised_json(app: API, test_client: requests.Session):
+    @app.route("/json")
+    def json_handler(req, resp):
+        resp.json_bytes = b'{"cached":true}'
+
+    response = test_client.get("http://testserver/json")
+
+    assert response.headers["Content-Type"] == "application/json"
+    assert response.content == b'{"cached":true}'
+
+
+def test_precompile_templates_warms_the_environment(tmp_path):
+    app = API(
+        templates_dir="tests/templates",
+        templates_cache_dir=str(tmp_path / "bytecode"),
+        templates_auto_reload=False,
+    )
+
+    names = app.precompile_templates()
+
+    assert sorted(names) == ["home.html", "index.html"]
+    assert len(app.templates_env.cache) == 2
+    assert len(list((tmp_path / "bytecode").iterdir())) == 2
+
+
+def test_templates_compiled_ahead_of_time(tmp_path):
+    API(templates_dir="tests/templates").precompile_templates(str(tmp_path))
+    app = API(templates_dir=str(tmp_path / "missing"), compiled_templates_dir=tmp_path)
+
+    body = app.template("home.html", {"title": "Some Title", "name": "Some Name"})
+    assert "Some Title" in body
+
+
+def test_cacheable_template_fragments(app: API):
+    app.cacheable_templates.add("home.html")
+    context = {"title": "Some Title", "name": "Some Name"}
+
+    first = app.template("home.html", context)
+    assert app.template("home.html", dict(context)) is first
+    assert len(app.fragments) == 1
+
+    assert "Other" in app.template("home.html", {**context, "title": "Other"})
+    assert app.template("home.html", {**context, "tags": ["a"]}, cache=True)
+    assert app.template("index.html", context, cache=False)
+    assert len(app.fragments) == 2
+
+    app.clear_template_cache()
+    assert not app.fragments
+
+
+def test_route_cache_is_shared_between_threads():
+    router = Router(cache_size=8)
+    router.add("/u/{id:d}", "user")
+    errors = []
+
+    def work():
+        try:
+            for _ in range(20000):
+                i = random.randrange(21)
+                assert router.match(f"/u/{i}") == ("user", {"id": i})
+        except Exception as e:
+            errors.append(e)
+
+    # switch threads as often as possible to hit the race
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+
+    assert errors == []
+    assert len(router._cache) <= 8
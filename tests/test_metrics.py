@@ -0,0 +1,105 @@
+import asyncio
+
+import requests
+
+from kaychen.api import API
+from kaychen.metrics import Metrics, MetricsMiddleware, current_timer
+from kaychen.middleware import Middleware
+
+
+def test_server_timing_header_lists_phases(app: API, test_client: requests.Session):
+    @app.route("/books/{id:d}")
+    def book(req, resp, id):
+        resp.html = app.template("home.html", {"title": "Book", "name": str(id)})
+
+    app.add_middleware(MetricsMiddleware)
+
+    response = test_client.get("http://testserver/books/3")
+
+    phases = [
+        part.split(";")[0] for part in response.headers["Server-Timing"].split(", ")
+    ]
+    assert phases[:3] == ["middleware", "route", "template"]
+    assert {"handler", "app", "serialize", "total"} <= set(phases)
+    assert "Book" in response.text
+
+
+def test_metrics_endpoint_reports_routes(app: API, test_client: requests.Session):
+    @app.route("/books/{id:d}")
+    def book(req, resp, id):
+        resp.text = "book"
+
+    app.add_middleware(MetricsMiddleware)
+
+    test_client.get("http://testserver/books/1")
+    test_client.get("http://testserver/books/2")
+    test_client.get("http://testserver/nothing")
+
+    response = test_client.get("http://testserver/metrics")
+    text = response.text
+
+    assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+    assert (
+        'kaychen_request_duration_seconds_count{method="GET",route="/books/{id:d}"} 2'
+        in text
+    )
+    assert (
+        'kaychen_request_duration_seconds_bucket{method="GET",route="/books/{id:d}",'
+        'le="+Inf"} 2' in text
+    )
+    assert (
+        'kaychen_requests_total{method="GET",route="<unmatched>",status="404"} 1'
+        in text
+    )
+    assert 'kaychen_phase_seconds_total{phase="handler"}' in text
+
+
+def test_orm_queries_are_counted_per_request(app: API, test_client, db, Author):
+    db.create(Author)
+    db.save(Author(name="john", age=23))
+    metrics = Metrics()
+
+    @app.route("/authors")
+    def authors(req, resp):
+        resp.json = {"names": [author.name for author in db.all(Author)]}
+        resp.json = {**resp.json, "count": len(db.all(Author))}
+
+    app.add_middleware(MetricsMiddleware, metrics=metrics, server_timing=False)
+
+    response = test_client.get("http://testserver/authors")
+
+    assert "Server-Timing" not in response.headers
+    assert metrics.queries[("GET", "/authors")] == 2
+    assert metrics.phases["db"] > 0
+
+
+def test_metrics_without_middleware_records_nothing(app: API, test_client, db, Author):
+    @app.route("/")
+    def index(req, resp):
+        db.create(Author)
+        resp.text = str(current_timer())
+
+    assert app.metrics is None
+    assert test_client.get("http://testserver/").text == "None"
+
+
+def test_metrics_wrap_other_middleware_and_async_handlers(app: API):
+    calls = []
+
+    class Recorder(Middleware):
+        def process_request(self, req):
+            calls.append("request")
+
+    @app.route("/async")
+    async def handler(req, resp):
+        await asyncio.sleep(0)
+        resp.text = "async"
+
+    app.add_middleware(Recorder)
+    app.add_middleware(MetricsMiddleware)
+
+    response = app.test_session().get("http://testserver/async")
+
+    assert calls == ["request"]
+    assert "handler;dur=" in response.headers["Server-Timing"]
+    assert app.metrics.latency[("GET", "/async")].count == 1
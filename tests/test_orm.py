@@ -1,8 +1,12 @@
+import inspect
 import sqlite3
+import threading
 
 import pytest
 
-from kaychen.orm import Column, Database, Table
+from kaychen.api import API
+from kaychen.middleware import SessionMiddleware
+from kaychen.orm import Column, Database, ForeignKey, Index, Table
 
 
 def test_delete_author(db, Author):
@@ -195,3 +199,743 @@ def test_create_tables(db, Author, Book):
         Book._get_create_sql()
         == "CREATE TABLE IF NOT EXISTS book (id INTEGER PRIMARY KEY AUTOINCREMENT, author_id INTEGER, published INTEGER, title TEXT);"
     )
+
+
+def test_sql_is_generated_once_per_class(db, Author, Book, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("class introspected again")
+
+    monkeypatch.setattr(inspect, "getmembers", fail)
+
+    db.create(Author)
+    db.create(Book)
+    john = Author(name="John Doe", age=43)
+    db.save(john)
+    db.save(Book(title="Building an ORM", published=True, author=john))
+
+    assert db.get(Book, 1).author.name == "John Doe"
+    assert Book._get_select_all_sql()[0] is Book._get_select_all_sql()[0]
+    assert Book(title="t", published=False, author=john)._get_update_sql() == (
+        "UPDATE book SET author_id = ?, published = ?, title = ? WHERE id = ?;",
+        [1, False, "t", None],
+    )
+
+
+def _count_selects(db):
+    statements = []
+    db.conn.set_trace_callback(
+        lambda sql: statements.append(sql) if sql.startswith("SELECT") else None
+    )
+    return statements
+
+
+def test_all_loads_foreign_keys_in_one_query(db, Author, Book):
+    db.create(Author)
+    db.create(Book)
+    john = Author(name="John Doe", age=43)
+    arash = Author(name="Arash Kun", age=50)
+    db.save(john)
+    db.save(arash)
+    for i, author in enumerate([john, arash, john, john]):
+        db.save(Book(title=f"Book {i}", published=True, author=author))
+
+    statements = _count_selects(db)
+    books = db.all(Book)
+
+    assert len(statements) == 2
+    assert [book.author.name for book in books] == [
+        "John Doe",
+        "Arash Kun",
+        "John Doe",
+        "John Doe",
+    ]
+    assert books[0].author is books[2].author
+
+
+def test_foreign_keys_are_loaded_through_several_levels(db, Author, Book):
+    class Review(Table):
+        text = Column(str)
+        book = ForeignKey(Book)
+
+    db.create(Author)
+    db.create(Book)
+    db.create(Review)
+    john = Author(name="John Doe", age=43)
+    db.save(john)
+    book = Book(title="Building an ORM", published=True, author=john)
+    db.save(book)
+    db.save(Review(text="great", book=book))
+    db.save(Review(text="okay", book=book))
+
+    statements = _count_selects(db)
+    reviews = db.all(Review)
+
+    assert len(statements) == 3
+    assert reviews[1].book.author.name == "John Doe"
+
+    statements.clear()
+    assert db.get(Review, 2).book.author.age == 43
+    assert len(statements) == 3
+
+
+def test_lazy_foreign_keys_are_fetched_on_first_access(db, Author, Book):
+    db.create(Author)
+    db.create(Book)
+    john = Author(name="John Doe", age=43)
+    db.save(john)
+    db.save(Book(title="Building an ORM", published=True, author=john))
+
+    statements = _count_selects(db)
+    book = db.get(Book, 1, lazy=True)
+
+    assert len(statements) == 1
+    assert book.author_id == 1
+    assert book.author.name == "John Doe"
+    assert book.author is book.author
+    assert len(statements) == 2
+
+
+def _count_commits(db):
+    statements = []
+    db.conn.set_trace_callback(
+        lambda sql: statements.append(sql) if sql.startswith("COMMIT") else None
+    )
+    return statements
+
+
+def test_save_many_update_many_delete_many(db, Author):
+    db.create(Author)
+    db.save(Author(name="Existing", age=1))
+    authors = [Author(name=f"Author {i}", age=i) for i in range(5)]
+
+    commits = _count_commits(db)
+    db.save_many(authors)
+
+    assert len(commits) == 1
+    assert [a.id for a in authors] == [2, 3, 4, 5, 6]
+    assert db.get(Author, 4).name == "Author 2"
+
+    for author in authors:
+        author.age += 10
+    db.update_many(authors)
+    db.delete_many(Author, [2, 3])
+
+    assert len(commits) == 3
+    assert sorted(a.age for a in db.all(Author)) == [1, 12, 13, 14]
+
+
+def test_transaction_groups_writes(db, Author):
+    db.create(Author)
+
+    commits = _count_commits(db)
+    with db.transaction():
+        john = Author(name="John Doe", age=23)
+        db.save(john)
+        john.age = 24
+        db.update(john)
+        db.save(Author(name="Vik Star", age=43))
+
+    assert len(commits) == 1
+    assert db.get(Author, 1).age == 24
+
+
+def test_transaction_rolls_back_on_error(db, Author):
+    db.create(Author)
+    db.save(Author(name="John Doe", age=23))
+
+    with pytest.raises(ValueError):
+        with db.transaction():
+            db.save(Author(name="Vik Star", age=43))
+            raise ValueError()
+
+    with db.transaction():
+        db.save(Author(name="Man Harsh", age=28))
+        with pytest.raises(ValueError):
+            with db.transaction():
+                db.delete(Author, 1)
+                raise ValueError()
+
+    assert sorted(a.name for a in db.all(Author)) == ["John Doe", "Man Harsh"]
+
+
+@pytest.fixture
+def library(db, Author, Book):
+    db.create(Author)
+    db.create(Book)
+    john = Author(name="John Doe", age=43)
+    arash = Author(name="Arash Kun", age=50)
+    db.save_many([john, arash])
+    db.save_many(
+        [
+            Book(title="Building an ORM", published=True, author=john),
+            Book(title="Scoring Goals", published=True, author=arash),
+            Book(title="Draft", published=False, author=john),
+            Book(title="Routing", published=True, author=john),
+        ]
+    )
+    return john, arash
+
+
+def test_query_filter_order_limit(db, Book, library):
+    john, _ = library
+
+    books = (
+        db.query(Book)
+        .filter(author=john, published=True)
+        .order_by("-id")
+        .limit(5)
+        .all()
+    )
+
+    assert [b.title for b in books] == ["Routing", "Building an ORM"]
+    assert books[0].author.name == "John Doe"
+    assert [b.id for b in db.query(Book).filter(id__gte=2, id__lt=4)] == [2, 3]
+    assert [b.id for b in db.query(Book).order_by("id").limit(2).offset(1)] == [2, 3]
+    assert db.query(Book).filter(title__in=["Draft", "Routing"]).count() == 2
+
+
+def test_query_sql_is_parameterised(db, Book):
+    sql, fields, params = (
+        db.query(Book)
+        .filter(author_id=3, published__gte=1)
+        .order_by("-id")
+        .limit(50)
+        .only("title")
+        ._get_sql()
+    )
+
+    assert sql == (
+        "SELECT id, title FROM book WHERE author_id = ? AND published >= ? "
+        "ORDER BY id DESC LIMIT ?;"
+    )
+    assert fields == ["id", "title"]
+    assert params == [3, 1, 50]
+
+
+def test_query_only_count_exists(db, Author, Book, library):
+    statements = _count_selects(db)
+    books = db.query(Book).only("title").all()
+
+    assert len(statements) == 1
+    assert books[0].title == "Building an ORM"
+    assert books[0].published is None
+
+    assert db.query(Book).count() == 4
+    assert db.query(Book).limit(2).count() == 2
+    assert db.query(Author).filter(name="Arash Kun").exists() is True
+    assert db.query(Author).filter(age__gt=60).exists() is False
+    assert db.query(Author).filter(age__gt=60).first() is None
+
+    with pytest.raises(AttributeError):
+        db.query(Book).filter(isbn="123")
+
+
+def test_iter_fetches_in_batches(db, Author, Book, library):
+    statements = _count_selects(db)
+    rows = db.iter(Book, batch_size=2)
+
+    assert statements == []
+    first = next(rows)
+    assert first.title == "Building an ORM"
+    assert first.author.name == "John Doe"
+    assert [b.id for b in rows] == [2, 3, 4]
+
+    assert [b.id for b in db.iter(Book, batch_size=3, after_id=2)] == [3, 4]
+    assert [b.id for b in db.query(Book).filter(published=True).iter(1)] == [1, 2, 4]
+
+
+def test_keyset_pagination(db, Book, library):
+    first_page = db.page(Book, limit=3)
+    second_page = db.page(Book, after_id=first_page[-1].id, limit=3)
+
+    assert [b.id for b in first_page] == [1, 2, 3]
+    assert [b.id for b in second_page] == [4]
+    assert db.page(Book, after_id=4) == []
+
+
+def test_iter_as_streamed_response_body(db, Author, library):
+    app = API(templates_dir="tests/templates")
+
+    @app.route("/authors")
+    def authors(req, resp):
+        resp.json_stream = (
+            {"id": a.id, "name": a.name} for a in db.iter(Author, batch_size=1)
+        )
+
+    response = app.test_session().get("http://testserver/authors")
+
+    assert "Content-Length" not in response.headers
+    assert response.json() == [
+        {"id": 1, "name": "John Doe"},
+        {"id": 2, "name": "Arash Kun"},
+    ]
+
+
+def test_pooled_database_uses_wal(tmp_path, Author):
+    db = Database(str(tmp_path / "pool.db"), pool_size=2, busy_timeout=1.0)
+    db.create(Author)
+    db.save(Author(name="John Doe", age=43))
+
+    assert db.conn.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+    assert db.conn.execute("PRAGMA synchronous;").fetchone()[0] == 1
+    assert db.conn.execute("PRAGMA busy_timeout;").fetchone()[0] == 1000
+    assert db.get(Author, 1).name == "John Doe"
+
+    with pytest.raises(ValueError):
+        Database(":memory:", pool_size=2)
+    db.close()
+
+
+def test_pooled_database_across_threads(tmp_path, Author, Book):
+    db = Database(str(tmp_path / "pool.db"), pool_size=2)
+    db.create(Author)
+    db.create(Book)
+    john = Author(name="John Doe", age=43)
+    db.save(john)
+
+    errors = []
+
+    def work(i):
+        try:
+            db.save(Book(title=f"Book {i}", published=True, author=john))
+            for book in db.iter(Book, batch_size=2):
+                assert book.author.name == "John Doe"
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    metrics = db.pool.metrics()
+    assert errors == []
+    assert db.query(Book).count() == 8
+    assert metrics["open"] <= 2
+    assert metrics["in_use"] == 0
+    assert metrics["checkouts"] >= 8
+    db.close()
+
+
+def test_iterator_resumed_on_another_thread(tmp_path, Author, Book):
+    db = Database(str(tmp_path / "pool.db"), pool_size=2)
+    db.create(Author)
+    db.create(Book)
+    john = Author(name="John Doe", age=43)
+    db.save(john)
+    for i in range(4):
+        db.save(Book(title=f"Book {i}", published=True, author=john))
+
+    books = db.iter(Book, batch_size=2)
+    seen = []
+
+    def first():
+        seen.append(next(books).title)
+        # the suspended iterator lends its connection to the thread that
+        # resumed it last
+        assert list(db.pool._readers) == [threading.get_ident()]
+        assert db.get(Author, 1).name == "John Doe"
+
+    def rest():
+        for book in books:
+            # and takes it back from the previous one
+            assert list(db.pool._readers) == [threading.get_ident()]
+            seen.append(book.title)
+
+    for target in (first, rest):
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+
+    metrics = db.pool.metrics()
+    assert seen == ["Book 0", "Book 1", "Book 2", "Book 3"]
+    assert db.pool._readers == {}
+    assert metrics["in_use"] == 0
+    assert metrics["checkouts"] == 1
+    db.close()
+
+
+def test_reads_inside_a_pooled_iteration_share_its_reader(tmp_path, Author, Book):
+    db = Database(str(tmp_path / "pool.db"), pool_size=1, timeout=0.5)
+    db.create(Author)
+    db.create(Book)
+    john = Author(name="John Doe", age=43)
+    db.save(john)
+    for i in range(3):
+        db.save(Book(title=f"Book {i}", published=True, author=john))
+
+    # the only reader is held by the iterator, other reads would time out
+    for book in db.iter(Book, batch_size=2):
+        assert db.get(Author, 1).name == "John Doe"
+        assert db.query(Book).count() == 3
+    for book in db.iter(Book, batch_size=2, lazy=True):
+        assert book.author.name == "John Doe"
+
+    assert db.pool.metrics()["in_use"] == 0
+    db.close()
+
+
+def test_pooled_transaction_reads_its_own_writes(tmp_path, Author):
+    db = Database(str(tmp_path / "pool.db"), pool_size=1)
+    db.create(Author)
+
+    with db.transaction():
+        db.save(Author(name="John Doe", age=43))
+        assert db.query(Author).count() == 1
+
+    assert db.get(Author, 1).name == "John Doe"
+    db.close()
+
+
+def test_rows_are_compact(db, Author, Book, library):
+    book = db.get(Book, 1)
+
+    assert not hasattr(book, "__dict__")
+    assert book.author_id == 1
+    with pytest.raises(AttributeError):
+        Author(name="John Doe", nickname="JD")
+
+    book.title = "Building an ORM, 2nd edition"
+    db.update(book)
+    assert db.get(Book, 1).title == "Building an ORM, 2nd edition"
+
+
+def test_rows_returns_named_tuples(db, Book, library):
+    rows = db.rows(Book)
+
+    assert len(rows) == 4
+    assert rows[1].title == "Scoring Goals"
+    assert rows[1].author_id == 2
+    assert rows[1]._fields == ("id", "author_id", "published", "title")
+
+
+def test_inherited_columns_follow_the_subclass_layout(db, Author):
+    class Writer(Author):
+        bio = Column(str)
+
+    db.create(Writer)
+    writer = Writer(name="John Doe", age=43, bio="Writes ORMs")
+    db.save(writer)
+
+    assert writer._get_insert_sql() == (
+        "INSERT INTO writer (age, bio, name) VALUES (?, ?, ?);",
+        [43, "Writes ORMs", "John Doe"],
+    )
+    from_db = db.get(Writer, 1)
+    assert (from_db.name, from_db.age, from_db.bio) == ("John Doe", 43, "Writes ORMs")
+    assert Author(name="Vik Star", age=23).name == "Vik Star"
+
+
+def test_session_identity_map(db, Author, Book, library):
+    statements = _count_selects(db)
+
+    with db.session() as session:
+        john = session.get(Author, 1)
+        books = session.all(Book)
+
+        assert session.get(Author, 1) is john
+        assert books[0].author is john
+        assert db.query(Author).filter(name="John Doe").first() is john
+        queries = len(statements)
+
+        assert session.get(Author, 1) is john
+        assert len(statements) == queries
+
+    assert db.get(Author, 1) is not john
+
+
+def test_session_invalidates_updates_and_deletes(db, Author, library):
+    with db.session() as session:
+        john = session.get(Author, 1)
+        john.age = 44
+        db.update(john)
+
+        fresh = session.get(Author, 1)
+        assert fresh is not john
+        assert fresh.age == 44
+
+        db.delete(Author, 2)
+        with pytest.raises(LookupError):
+            session.get(Author, 2)
+
+        vik = Author(name="Vik Star", age=23)
+        db.save(vik)
+        assert session.get(Author, vik.id) is vik
+
+
+def test_session_middleware(db, Author, Book, library):
+    app = API(templates_dir="tests/templates")
+    app.add_middleware(SessionMiddleware, database=db)
+    statements = _count_selects(db)
+
+    @app.route("/authors/{id:d}")
+    def author(req, resp, id):
+        first = db.get(Author, id)
+        second = req.db_session.get(Author, id)
+        resp.json = {"name": first.name, "same": first is second}
+
+    response = app.test_session().get("http://testserver/authors/1")
+
+    assert response.json() == {"name": "John Doe", "same": True}
+    assert len(statements) == 1
+
+
+def test_json_response_serialises_rows_and_queries(db, Author, Book, library):
+    app = API(templates_dir="tests/templates")
+
+    @app.route("/books/{id:d}")
+    def book(req, resp, id):
+        resp.json = db.get(Book, id)
+
+    @app.route("/authors")
+    def authors(req, resp):
+        resp.json = db.query(Author).order_by("-age").only("name")
+
+    client = app.test_session()
+
+    assert client.get("http://testserver/books/2").json() == {
+        "id": 2,
+        "author_id": 2,
+        "published": 1,
+        "title": "Scoring Goals",
+        "author": {"id": 2, "age": 50, "name": "Arash Kun"},
+    }
+    assert client.get("http://testserver/authors").json() == [
+        {"id": 2, "age": None, "name": "Arash Kun"},
+        {"id": 1, "age": None, "name": "John Doe"},
+    ]
+
+
+def test_query_statements_are_cached(db, Book, library):
+    john, _ = library
+    db.statements.clear()
+    hits = db.statements.hits
+
+    for _ in range(3):
+        db.query(Book).filter(author=john, published=True).order_by("-id").all()
+    db.query(Book).filter(author=john).count()
+    db.query(Book).filter(author=john).count()
+
+    metrics = db.statement_metrics()
+    # the select, its foreign key IN list and the count are built once
+    assert metrics["entries"] == 3
+    assert metrics["hits"] - hits == 5
+    assert metrics["cached_statements"] == 256
+
+
+def test_executed_statements_fit_sqlites_statement_cache(db, Author, Book, library):
+    def work():
+        book = db.get(Book, 1)
+        db.update(book)
+        db.save(Author(name="Jane Doe", age=30))
+        db.delete(Author, db.query(Author).filter(name="Jane Doe").first().id)
+        db.query(Book).filter(published=True).all()
+
+    work()
+    distinct = db.statement_metrics()["distinct_sql"]
+    work()
+
+    # the fixed insert, update, delete and get statements are counted too, a
+    # repeated workload runs no new SQL text
+    metrics = db.statement_metrics()
+    assert Book._update_sql in db.executed_sql
+    assert Author._insert_sql in db.executed_sql
+    assert Author._delete_sql in db.executed_sql
+    assert metrics["distinct_sql"] == distinct
+    assert distinct <= metrics["cached_statements"]
+
+
+def test_in_lists_are_padded_to_a_few_statement_shapes(db, Author, Book):
+    db.create(Author)
+    db.create(Book)
+    authors = [Author(name=f"author {i}", age=i) for i in range(7)]
+    db.save_many(authors)
+    db.save_many([Book(title=str(a.age), author=a) for a in authors])
+    statements = _count_selects(db)
+
+    books = db.all(Book)
+
+    assert [book.author.name for book in books] == [a.name for a in authors]
+    assert statements[1].endswith("IN (1, 2, 3, 4, 5, 6, 7, 7);")
+    assert len(db.statements) == 1
+
+
+def test_statement_cache_is_bounded(tmp_path, Author):
+    db = Database(str(tmp_path / "bounded.db"), statement_cache_size=2)
+    db.create(Author)
+
+    for age in range(4):
+        db.query(Author).filter(age__gt=age).order_by("age").all()
+        db.query(Author).order_by("-age").limit(age + 1).all()
+        db.query(Author).filter(name="x").all()
+
+    assert len(db.statements) == 2
+    assert db.statements.misses == 12
+
+
+def test_create_emits_declared_and_foreign_key_indexes(db, Author):
+    class Review(Table):
+        title = Column(str, unique=True)
+        stars = Column(int, index=True)
+        author = ForeignKey(Author)
+        editor = ForeignKey(Author, index=False)
+
+        class Meta:
+            indexes = [("author", "stars"), Index("stars", "title", name="by_stars")]
+
+    assert Review._get_index_sql() == [
+        "CREATE INDEX IF NOT EXISTS ix_review_author_id ON review (author_id);",
+        "CREATE INDEX IF NOT EXISTS ix_review_stars ON review (stars);",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_review_title ON review (title);",
+        "CREATE INDEX IF NOT EXISTS ix_review_author_id_stars ON review (author_id, stars);",
+        "CREATE INDEX IF NOT EXISTS by_stars ON review (stars, title);",
+    ]
+
+    db.create(Author)
+    db.create(Review)
+    db.create(Review)
+    indexes = db._fetchall(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'review';"
+    )
+    assert len(indexes) == 5
+
+    db.save(Review(title="Great", stars=5))
+    with pytest.raises(sqlite3.IntegrityError):
+        db.save(Review(title="Great", stars=4))
+
+
+def test_unknown_index_field_is_rejected():
+    with pytest.raises(AttributeError):
+
+        class Broken(Table):
+            title = Column(str)
+
+            class Meta:
+                indexes = [("missing",)]
+
+
+def test_explain_shows_index_use(db, Book, library):
+    john, _ = library
+
+    plan = db.query(Book).filter(author=john).explain()
+    assert any("USING INDEX ix_book_author_id" in step for step in plan)
+
+    plan = db.explain(db.query(Book).filter(title="Draft"))
+    assert any(step.startswith("SCAN book") for step in plan)
+
+    plan = db.explain("SELECT * FROM book WHERE id = ?;", [1])
+    assert any("INTEGER PRIMARY KEY" in step for step in plan)
+
+
+def test_migrate_adds_columns_in_place(db, Author, AuthorVerbose):
+    assert db.migrate(Author) == [
+        "CREATE TABLE IF NOT EXISTS author (id INTEGER PRIMARY KEY AUTOINCREMENT, age INTEGER, name TEXT);"
+    ]
+    db.save(Author(name="John Doe", age=43))
+
+    assert db.migrate(AuthorVerbose) == ["ALTER TABLE author ADD COLUMN surname TEXT;"]
+    db.save(AuthorVerbose(name="Man Harsh", surname="random", age=35))
+
+    authors = db.all(AuthorVerbose)
+    assert [(a.name, a.surname) for a in authors] == [
+        ("John Doe", None),
+        ("Man Harsh", "random"),
+    ]
+
+
+def test_migrate_skips_recorded_versions(db, Author, Book):
+    db.migrate(Author, Book)
+    statements = []
+    db.conn.set_trace_callback(statements.append)
+
+    assert db.migrate(Author, Book) == []
+    assert [s for s in statements if "PRAGMA" in s] == []
+    assert len([s for s in statements if s.startswith("SELECT")]) == 1
+
+
+def test_migrate_rebuilds_changed_tables(db, AuthorVerbose, Book):
+    db.migrate(AuthorVerbose)
+    db.save_many(
+        [AuthorVerbose(name=f"author {i}", surname="x", age=i) for i in range(25)]
+    )
+
+    class Author(Table):
+        name = Column(str, index=True)
+        age = Column(str)
+
+    statements = db.migrate(Author)
+
+    assert "ALTER TABLE author__new RENAME TO author;" in statements
+    authors = db.all(Author)
+    assert len(authors) == 25
+    assert authors[24].name == "author 24"
+    assert authors[24].age == "24"
+    assert any(
+        "ix_author_name" in step for step in db.query(Author).filter(name="a").explain()
+    )
+
+    db.save(Author(name="new", age="1"))
+    assert db.query(Author).order_by("-id").first().id == 26
+
+
+def test_group_commit_batches_concurrent_writes(tmp_path, Author):
+    class Tag(Table):
+        name = Column(str, unique=True)
+
+    db = Database(
+        str(tmp_path / "group.db"), pool_size=2, group_commit=True, max_delay=0.01
+    )
+    db.create(Author)
+    db.create(Tag)
+    commits = _count_commits(db)
+
+    tags = [Tag(name=f"tag {i}") for i in range(16)] + [Tag(name="tag 0")]
+    errors = []
+
+    def work(tag):
+        try:
+            db.save(tag)
+        except sqlite3.IntegrityError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(tag,)) for tag in tags]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    metrics = db.group_writer.metrics()
+    assert len(errors) == 1
+    assert sorted(tag.id for tag in tags if tag.id) == list(range(1, 17))
+    assert db.query(Tag).count() == 16
+    assert metrics["writes"] == 17
+    assert metrics["errors"] == 1
+    assert metrics["groups"] < 17
+    assert len(commits) == metrics["groups"]
+
+    # writes inside a transaction of the calling thread bypass the queue
+    with db.transaction():
+        db.save(Author(name="John Doe", age=43))
+        db.update(Author(name="Jane Doe", age=40))
+    assert db.group_writer.metrics()["writes"] == 17
+    db.close()
+
+    # nothing is left to run the write, it fails instead of waiting
+    with pytest.raises(sqlite3.ProgrammingError):
+        db.save(Tag(name="late"))
+
+    with pytest.raises(ValueError):
+        Database(str(tmp_path / "single.db"), group_commit=True)
+
+
+def test_outer_rollback_discards_released_savepoints(db, Author):
+    db.create(Author)
+
+    with pytest.raises(RuntimeError):
+        with db.transaction():
+            with db.transaction():
+                db.save(Author(name="John Doe", age=43))
+            raise RuntimeError("abort")
+
+    assert db.query(Author).count() == 0
@@ -0,0 +1,105 @@
+import time
+
+import requests
+
+from test_kaychen import _asgi_request
+
+from kaychen.api import API
+from kaychen.metrics import MetricsMiddleware
+from kaychen.orm import Database
+from kaychen.profiling import ProfilerMiddleware
+
+
+def test_slow_requests_are_recorded_with_their_sql(
+    app: API, test_client: requests.Session, db, Author, tmp_path
+):
+    db.create(Author)
+    john = Author(name="john", age=23)
+    db.save(john)
+
+    @app.route("/authors/{id:d}")
+    def author(req, resp, id):
+        resp.text = db.get(Author, id=id).name
+        time.sleep(0.02)
+
+    @app.route("/fast")
+    def fast(req, resp):
+        resp.text = "fast"
+
+    app.add_middleware(ProfilerMiddleware, directory=str(tmp_path), threshold=0.01)
+
+    assert test_client.get("http://testserver/fast").text == "fast"
+    assert test_client.get(f"http://testserver/authors/{john.id}").text == "john"
+
+    middleware = app.middleware.app
+    (record,) = middleware.records()
+    assert record["route"] == "/authors/{id:d}"
+    assert record["kwargs"] == {"id": str(john.id)}
+    assert record["status"] == "200 OK"
+    assert record["duration"] >= 0.02
+    # requests that were not sampled run without collecting anything
+    assert record["statements"] is None
+    assert record["profile"] is None
+    assert middleware.slow_routes == {"/authors/{id:d}"}
+
+    # the next request to the slow route is profiled
+    test_client.get(f"http://testserver/authors/{john.id}")
+    record = middleware.records()[-1]
+    assert record["statements"][0]["sql"].startswith("SELECT")
+    assert "cumulative" in record["profile"]
+    assert not middleware.slow_routes
+    assert len(list(tmp_path.glob("*.prof"))) == 1
+
+
+def test_sampled_requests_are_profiled_into_a_ring_buffer(
+    app: API, test_client: requests.Session, tmp_path
+):
+    @app.route("/")
+    def index(req, resp):
+        resp.text = "hello"
+
+    app.add_middleware(
+        ProfilerMiddleware,
+        directory=str(tmp_path),
+        threshold=60,
+        sample_rate=1.0,
+        max_records=3,
+    )
+    app.add_middleware(MetricsMiddleware)
+
+    for _ in range(5):
+        test_client.get("http://testserver/")
+
+    assert len(list(tmp_path.glob("*.json"))) == 3
+    assert len(list(tmp_path.glob("*.prof"))) == 3
+    records = app.middleware.app.app.records()
+    assert all(record["profile"] for record in records)
+    assert records[0]["time"] <= records[-1]["time"]
+
+    # a new process continues after the newest record
+    assert ProfilerMiddleware(app, directory=str(tmp_path), max_records=3)._slot == 2
+
+
+def test_asgi_requests_are_recorded_without_a_profile(app: API, Author, tmp_path):
+    # sync handlers run on worker threads under ASGI
+    db = Database(str(tmp_path / "pool.db"), pool_size=1)
+    db.create(Author)
+    db.save(Author(name="john", age=23))
+
+    @app.route("/authors")
+    def authors(req, resp):
+        resp.text = db.get(Author, id=1).name
+
+    app.add_middleware(
+        ProfilerMiddleware, directory=str(tmp_path), threshold=60, sample_rate=1.0
+    )
+
+    status, _, body = _asgi_request(app, "GET", "/authors")
+
+    assert (status, body) == (200, b"john")
+    (record,) = app.middleware.app.records()
+    assert record["statements"][0]["sql"].startswith("SELECT")
+    # cProfile on the event loop would miss the handler's thread
+    assert record["profile"] is None
+    assert not list(tmp_path.glob("*.prof"))
+    db.close()
@@ -0,0 +1,175 @@
+import sqlite3
+import threading
+
+import pytest
+import requests
+
+from kaychen.api import API
+from kaychen.orm import Column, Database, ForeignKey, Table
+from kaychen.replication import DatabaseRouter, RouterMiddleware
+
+
+class Author(Table):
+    name = Column(str)
+
+
+class Event(Table):
+    kind = Column(str)
+
+
+@pytest.fixture
+def router(tmp_path):
+    primary = Database(str(tmp_path / "primary.db"))
+    primary.create(Author)
+    router = DatabaseRouter(primary, shards={Event: str(tmp_path / "events.db")})
+    router.create(Event)
+    router.add_snapshot(str(tmp_path / "snapshot.db"))
+    yield router
+    router.close()
+
+
+def test_reads_go_to_replicas_and_writes_to_the_primary(router):
+    with router.request():
+        assert router.for_read(Author) is router.replicas[0]
+        router.save(Author(name="John Doe"))
+        # read your writes for the rest of the request
+        assert router.for_read(Author) is router.primary
+        assert router.get(Author, 1).name == "John Doe"
+
+    with router.request():
+        # the snapshot is behind until it is refreshed
+        with pytest.raises(LookupError):
+            router.get(Author, 1)
+        router.refresh()
+        assert router.get(Author, 1).name == "John Doe"
+
+        with pytest.raises(sqlite3.OperationalError):
+            router.replicas[0].save(Author(name="read only"))
+
+
+def test_sharded_tables_live_in_their_own_file(router, tmp_path):
+    router.save_many([Event(kind="login"), Author(name="Jane"), Event(kind="logout")])
+
+    assert router.for_write(Event) is router.for_read(Event) is router.shards[Event]
+    assert [event.kind for event in router.all(Event)] == ["login", "logout"]
+    assert router.shards[Event].tables == ["event", "sqlite_sequence"]
+    assert "event" not in router.primary.tables
+
+
+def test_batches_are_committed_once_per_database(router):
+    class Note(Table):
+        text = Column(str)
+
+    router.create(Note)
+    calls = []
+    save_many = router.primary.save_many
+
+    def counting_save_many(instances):
+        calls.append([type(instance).__name__ for instance in instances])
+        save_many(instances)
+
+    router.primary.save_many = counting_save_many
+    router.save_many(
+        [Author(name="Jane"), Event(kind="login"), Note(text="hi"), Author(name="Bo")]
+    )
+
+    assert calls == [["Author", "Note", "Author"]]
+    assert [event.kind for event in router.all(Event)] == ["login"]
+    assert len(router.primary.all(Author)) == 2
+
+
+def test_stickiness_outside_requests_expires(router):
+    router.sticky_seconds = 0
+    router.save(Author(name="John Doe"))
+    assert router.for_read(Author) is router.replicas[0]
+
+
+def test_router_middleware_scopes_stickiness(router):
+    app = API(templates_dir="tests/templates")
+    app.add_middleware(RouterMiddleware, router=router)
+    reads = []
+
+    @app.route("/authors")
+    def authors(req, resp):
+        reads.append(router.for_read(Author))
+        if req.method == "POST":
+            router.save(Author(name="New"))
+            reads.append(router.for_read(Author))
+        resp.text = "ok"
+
+    client: requests.Session = app.test_session()
+    client.post("http://testserver/authors")
+    client.get("http://testserver/authors")
+
+    replica = router.replicas[0]
+    assert reads == [replica, router.primary, replica]
+
+
+def test_live_read_only_replica_of_the_primary(tmp_path):
+    path = str(tmp_path / "primary.db")
+    router = DatabaseRouter(path, replicas=[path])
+    router.create(Author)
+    router.save(Author(name="John Doe"))
+
+    with router.request():
+        assert router.for_read(Author) is router.replicas[0]
+        assert router.get(Author, 1).name == "John Doe"
+    router.close()
+
+
+def test_replicas_are_read_only_pools(tmp_path):
+    path = str(tmp_path / "primary.db")
+    router = DatabaseRouter(path, replicas=[path], pool_size=2)
+    router.create(Author)
+    router.save_many([Author(name=f"author {i}") for i in range(4)])
+    snapshot = router.add_snapshot(str(tmp_path / "snapshot.db"))
+    replica = router.replicas[0]
+    errors = []
+
+    def work():
+        try:
+            with router.request():
+                for _ in range(5):
+                    assert len(router.all(Author)) == 4
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert replica.pool.read_only and replica.conn is None
+    assert 1 <= replica.pool.metrics()["open"] <= 2
+    with pytest.raises(sqlite3.OperationalError):
+        replica.save(Author(name="read only"))
+
+    # the primary is pooled too, so the snapshot refreshes from any thread
+    router.save(Author(name="late"))
+    refresh = threading.Thread(target=router.refresh)
+    refresh.start()
+    refresh.join()
+    assert len(snapshot.all(Author)) == 5
+    router.close()
+
+
+def test_foreign_keys_across_databases_are_rejected(router, tmp_path):
+    class Login(Table):
+        author = ForeignKey(Author)
+
+    class Audit(Table):
+        event = ForeignKey(Event)
+
+    # a primary table referencing a sharded one
+    with pytest.raises(ValueError):
+        router.create(Audit)
+    with pytest.raises(ValueError):
+        router.migrate(Audit)
+    # a sharded table referencing a primary one
+    with pytest.raises(ValueError):
+        DatabaseRouter(router.primary, shards={Login: str(tmp_path / "logins.db")})
+
+    router.create(Login)
+    assert "login" in router.primary.tables